@@ -0,0 +1,98 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import *
+
+import typer
+from loguru import logger
+
+ROOT = Path(__file__).resolve().parent.parent
+CLI = ROOT.joinpath('scripts', 'utils.py')
+BASELINE_PATH = Path(__file__).resolve().parent.joinpath('cli_startup_baseline.json')
+
+COMMANDS = ['split-manifest-to-segments', 'run-gdc-client-download-on-directory', 'insert-data', 'export-file-info',
+            'generate-variance-table', 'compute-variance']
+HEAVY_MODULES = ['pandas', 'numpy', 'pymongo', 'requests', 'tqdm']
+INTERPRETER = 'python -c pass'
+
+app = typer.Typer()
+
+
+def time_command(args) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def time_commands(commands: Dict[str, List[str]], repeats: int) -> Dict[str, float]:
+    """
+    Median run time of every command. Runs are interleaved after a warm up round so that load changes on the machine
+    affect all commands alike.
+    """
+    for args in commands.values():
+        time_command(args)
+    timings = {name: [] for name in commands}
+    for _ in range(repeats):
+        for name, args in commands.items():
+            timings[name].append(time_command(args))
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def heavy_modules_on_import():
+    code = f'import json, sys, scripts.utils; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))'
+    result = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, cwd=ROOT)
+    return json.loads(result.stdout)
+
+
+@app.command()
+def main(repeats: int = typer.Option(10, help='Number of runs per command, the median is reported'),
+         tolerance: float = typer.Option(0.25, help='Allowed relative slowdown against the baseline'),
+         update_baseline: bool = typer.Option(False, help='If True, write the measured timings as the new baseline')):
+    """
+    Times "--help" of the CLI and of every command and fails if any is slower than the stored baseline by more than
+    the tolerance, or if importing the CLI pulls in a heavy dependency. Timings are stored and compared as multiples
+    of the startup time of a bare interpreter ("python -c pass") on the same machine, so the baseline carries over to
+    slower or faster runners.
+    """
+    heavy = heavy_modules_on_import()
+    if heavy:
+        logger.error(f'Importing scripts.utils loads heavy modules: {heavy}')
+        raise typer.Exit(1)
+
+    commands = {INTERPRETER: ['-c', 'pass'], '--help': [str(CLI), '--help']}
+    commands.update({command: [str(CLI), command, '--help'] for command in COMMANDS})
+    timings = time_commands(commands, repeats)
+    interpreter = timings.pop(INTERPRETER)
+    ratios = {name: seconds / interpreter for name, seconds in timings.items()}
+
+    if update_baseline:
+        with BASELINE_PATH.open('w') as f:
+            json.dump(ratios, f, indent=2)
+            f.write('\n')
+        logger.info(f'Wrote baseline to {BASELINE_PATH}')
+        return
+
+    if not BASELINE_PATH.exists():
+        logger.error(f'No baseline at {BASELINE_PATH}, record one with --update-baseline')
+        raise typer.Exit(1)
+
+    baseline = json.loads(BASELINE_PATH.read_text())
+    logger.info(f'python -c pass: {interpreter * 1000:.0f}ms')
+    regressions = []
+    for name, ratio in ratios.items():
+        reference = baseline.get(name)
+        logger.info(f'{name}: {timings[name] * 1000:.0f}ms, {ratio:.2f}x interpreter startup' +
+                    (f' (baseline {reference:.2f}x)' if reference else ''))
+        if reference and ratio > reference * (1 + tolerance):
+            regressions.append(name)
+
+    if regressions:
+        logger.error(f'Startup regressed for: {regressions}')
+        raise typer.Exit(1)
+
+
+if __name__ == '__main__':
+    app()
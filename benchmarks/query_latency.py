@@ -0,0 +1,173 @@
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import *
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import bson
+import typer
+from loguru import logger
+from pymongo import IndexModel, MongoClient
+
+from descriptive import DataFetcher
+from scripts.index_planner import explain_command
+from scripts.ingestion import DEFAULT_INDEXES, PROJECT_INDEX
+from scripts.project_stats import pipeline_for_moments_by_project
+
+BASELINE_PATH = Path(__file__).resolve().parent.joinpath('query_latency_baseline.json')
+EXAMINED_KEYS = ['docs_examined', 'keys_examined', 'bytes_returned']
+
+app = typer.Typer()
+
+
+def seed_collection(col, n_patients: int, n_names: int, n_projects: int, seed: int):
+    """
+    Fills ``col`` with one document per ``(patient, name)`` pair, shaped like the documents written by the mRNA
+    inserter, and creates the indexes the inserter creates for the field project layout. The query shapes are the
+    same for each collection of the per-project layout, which only differ in size.
+    """
+    rng = random.Random(seed)
+    col.drop()
+    batch = []
+    for i in range(n_patients):
+        patient = f'TCGA-{i:02X}-{i:04d}'
+        project = f'TCGA-P{i % n_projects}'
+        for j in range(n_names):
+            batch.append({'name': f'ENSG{j:011d}', 'value': rng.random() * 100, 'patient': patient,
+                          'project': project, 'metadata': {'gene_name': f'G{j}', 'gene_type': 'protein_coding'}})
+            if len(batch) == 10000:
+                col.insert_many(batch)
+                batch = []
+    if batch:
+        col.insert_many(batch)
+    col.create_indexes([IndexModel(key) for key in DEFAULT_INDEXES + [PROJECT_INDEX]])
+
+
+def query_shapes(col_name: str, name: str) -> Dict[str, dict]:
+    """
+    Every query the dashboard (``DataFetcher``) and ``generate-variance-table`` send, as server commands.
+    """
+    return {
+        'DataFetcher.name_specific_values': {
+            'aggregate': col_name, 'pipeline': DataFetcher.pipeline_for_name_specific_values(name=name), 'cursor': {}},
+        'DataFetcher.collection_to_dataframe': {
+            'aggregate': col_name, 'pipeline': DataFetcher.pipeline_for_collection_to_dataframe(), 'cursor': {}},
+        'DataFetcher.variance_for_collection': {
+            'aggregate': col_name, 'pipeline': DataFetcher.pipeline_for_variance_for_collection(), 'cursor': {}},
+        'DataFetcher.all_names': {'distinct': col_name, 'key': 'name'},
+        'generate_variance_table.values_for_name': {'find': col_name, 'filter': {'name': name}},
+        'generate_variance_table.by_project': {
+            'aggregate': col_name, 'pipeline': pipeline_for_moments_by_project(), 'cursor': {}},
+    }
+
+
+def run_command(db, command: dict) -> int:
+    """
+    Runs ``command`` to completion and returns the number of BSON bytes sent back.
+    """
+    col = db[next(iter(command.values()))]
+    if 'aggregate' in command:
+        return sum(len(bson.encode(doc)) for doc in col.aggregate(command['pipeline'], batchSize=10000))
+    if 'find' in command:
+        return sum(len(bson.encode(doc)) for doc in col.find(command['filter'], batch_size=10000))
+    return len(bson.encode({'values': col.distinct(command['key'])}))
+
+
+def measure(db, col_name: str, names: List[str], repeats: int) -> Dict[str, dict]:
+    results = {}
+    for shape in query_shapes(col_name, names[0]):
+        timings, bytes_returned = [], []
+        for i in range(repeats):
+            command = query_shapes(col_name, names[i % len(names)])[shape]
+            start = time.perf_counter()
+            bytes_returned.append(run_command(db, command))
+            timings.append(time.perf_counter() - start)
+
+        explain = explain_command(db, query_shapes(col_name, names[0])[shape]) or {}
+        quantiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+        results[shape] = dict(p50=quantiles[49], p95=quantiles[94], p99=quantiles[98],
+                              docs_examined=explain.get('docs_examined'),
+                              keys_examined=explain.get('keys_examined'),
+                              bytes_returned=int(statistics.median(bytes_returned)))
+        logger.info(f'{shape}: p50 {results[shape]["p50"] * 1000:.1f}ms, p95 {results[shape]["p95"] * 1000:.1f}ms, '
+                    f'{results[shape]["docs_examined"]} docs / {results[shape]["keys_examined"]} keys examined, '
+                    f'{results[shape]["bytes_returned"]} bytes')
+    return results
+
+
+def find_regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Latency percentiles may be slower than the baseline by ``tolerance``. Examined documents and keys and returned
+    bytes do not depend on the machine, so any increase means the query shape or its plan changed.
+    """
+    regressions = []
+    for shape, stats in results.items():
+        reference = baseline.get(shape)
+        if not reference:
+            continue
+        for key in ['p50', 'p95']:
+            if stats[key] > reference[key] * (1 + tolerance):
+                regressions.append(f'{shape} {key}: {reference[key] * 1000:.1f}ms -> {stats[key] * 1000:.1f}ms')
+        for key in EXAMINED_KEYS:
+            if stats[key] is not None and reference.get(key) is not None and stats[key] > reference[key]:
+                regressions.append(f'{shape} {key}: {reference[key]} -> {stats[key]}')
+    return regressions
+
+
+@app.command()
+def main(mongo_connection_string: str = typer.Option('mongodb://localhost:27017',
+                                                     help='Connection string of a local, otherwise idle mongod'),
+         db_name: str = typer.Option('query_latency_benchmark', help='Scratch database, dropped when done'),
+         n_patients: int = typer.Option(200, help='Number of synthetic patients'),
+         n_names: int = typer.Option(500, help='Number of synthetic features per patient'),
+         n_projects: int = typer.Option(4, help='Number of synthetic projects the patients are spread over'),
+         repeats: int = typer.Option(20, help='Number of runs per query shape'),
+         tolerance: float = typer.Option(0.25, help='Allowed relative latency slowdown against the baseline'),
+         seed: int = typer.Option(0, help='Random seed for the synthetic values'),
+         keep: bool = typer.Option(False, help='If True, keep the seeded database for inspection'),
+         update_baseline: bool = typer.Option(False, help='If True, write the measurements as the new baseline')):
+    """
+    Seeds synthetic omics data, times every dashboard and variance table query shape and fails if any is slower than
+    the stored baseline by more than the tolerance, or examines or returns more than it did.
+    """
+    params = dict(n_patients=n_patients, n_names=n_names, n_projects=n_projects, repeats=repeats, seed=seed)
+    with MongoClient(mongo_connection_string) as client:
+        db = client[db_name]
+        logger.info(f'Seeding {n_patients * n_names} documents')
+        seed_collection(db['mRNA'], n_patients=n_patients, n_names=n_names, n_projects=n_projects, seed=seed)
+        names = random.Random(seed).sample([f'ENSG{j:011d}' for j in range(n_names)], k=min(n_names, repeats))
+        try:
+            results = measure(db, 'mRNA', names, repeats)
+        finally:
+            if not keep:
+                client.drop_database(db_name)
+
+    if update_baseline:
+        with BASELINE_PATH.open('w') as f:
+            json.dump(dict(params=params, results=results), f, indent=2)
+        logger.info(f'Wrote baseline to {BASELINE_PATH}')
+        return
+
+    if not BASELINE_PATH.exists():
+        logger.error(f'No baseline at {BASELINE_PATH}, record one with --update-baseline on a reference machine')
+        raise typer.Exit(1)
+    baseline = json.loads(BASELINE_PATH.read_text())
+    if baseline['params'] != params:
+        logger.error(f'Baseline was recorded with {baseline["params"]}, not {params}. Rerun with the same parameters '
+                     f'or record a new baseline with --update-baseline')
+        raise typer.Exit(1)
+
+    regressions = find_regressions(results, baseline['results'], tolerance)
+    if regressions:
+        for regression in regressions:
+            logger.error(regression)
+        raise typer.Exit(1)
+
+
+if __name__ == '__main__':
+    app()
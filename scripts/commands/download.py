@@ -0,0 +1,58 @@
+import csv
+import os.path
+from pathlib import Path
+
+import typer
+
+
+def split_manifest_to_segments(manifest_path: str = typer.Option(..., help='Path to manifest file'),
+                               number_of_segments: int = typer.Option(...,
+                                                                      help='Number of segments to split the data '
+                                                                           'frame into. Number of concurrent '
+                                                                           'downloads depends on it.'),
+                               output_directory: str = typer.Option(...,
+                                                                    help='Directory to output the resulting splits to')
+                               ) -> str:
+    base_name = Path(manifest_path).stem
+    with open(manifest_path, newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        rows = list(reader)
+
+    # Same segment sizes as np.array_split: the first len(rows) % number_of_segments segments get one extra row
+    size, extra = divmod(len(rows), number_of_segments)
+    start = 0
+    for i in range(number_of_segments):
+        end = start + size + (i < extra)
+        with open(os.path.join(output_directory, f'{base_name}_{i}.txt'), 'w', newline='') as f:
+            writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+            writer.writerow(header)
+            writer.writerows(rows[start:end])
+        start = end
+
+    return output_directory
+
+
+def run_gdc_client_download_on_directory(
+        manifests_directory: str = typer.Option(..., help='Directory containing manifest files'),
+        number_of_concurrent_downloads: int = typer.Option(..., help='Number of simultaneous downloads to perform'),
+        output_directory: str = typer.Option(..., help='Directory to dump the resulting files to'),
+        manifests_regex_expression: str = typer.Option("*.txt",
+                                                       help='Regex expression to select on specific manifest files'),
+        report_interval: float = typer.Option(10., help='Seconds between progress reports'),
+        split_stragglers: bool = typer.Option(True, help='If True, split the remaining files of the slowest segment '
+                                                         'into new segments whenever a download slot is idle'),
+        straggler_grace: float = typer.Option(60., help='Seconds a segment runs before it can be split'),
+        min_split_eta: float = typer.Option(120., help='Segments expected to finish sooner than this many seconds '
+                                                       'are never split')
+):
+    from scripts.downloads import DownloadSupervisor
+
+    manifest_files = sorted(Path(manifests_directory).glob(manifests_regex_expression))
+    DownloadSupervisor(manifest_paths=manifest_files,
+                       output_directory=output_directory,
+                       number_of_concurrent_downloads=number_of_concurrent_downloads,
+                       report_interval=report_interval,
+                       split_stragglers=split_stragglers,
+                       straggler_grace=straggler_grace,
+                       min_split_eta=min_split_eta).run()
@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+
+import typer
+
+
+def insert_data(
+        subject: str = typer.Option(..., help='Omics data type, e.g.: ["mRNA", "DNAm", "miRNA"]',
+                                    prompt_required=True),
+        base_dir: str = typer.Option(...,
+                                     help='Directory in which the downloaded files are located at. Should '
+                                          'conform with the files downloaded from the GDC manifest',
+                                     prompt_required=True),
+        mongo_connection_string: str = typer.Option(...,
+                                                    help='Connection string used to connect to MongoDB. Must '
+                                                         'have read/write privileges on the database',
+                                                    prompt_required=True),
+        db_name: str = typer.Option(..., help='Database name being written to', prompt_required=True),
+        override: bool = typer.Option(...,
+                                      help='If True, the existing collection will be dropped and a new one will be '
+                                           'written instead, otherwise, will attempt to draw all existing patients '
+                                           'names and continue parsing only for missing patients'),
+        col_name: str = typer.Option(None, help='Optional collection name. If not provided, "subject" will be used.'),
+        indexes_file: str = typer.Option(None, help='Optional JSON file with the index set to create, e.g. the output '
+                                                    'of "index_planner.py plan". If not provided, the default '
+                                                    'indexes will be used.'),
+        shard_index: int = typer.Option(0, help='Index of this shard when ingesting from several hosts at once'),
+        shard_count: int = typer.Option(1, help='Total number of shards. Patients are partitioned between shards by '
+                                                'a hash of their name. Shard 0 coordinates the run: it is the only one '
+                                                'that drops the collection and creates indexes'),
+        run_id: str = typer.Option(None, help='Identifier shared by all shards of a single run. Required when '
+                                              '"shard-count" is larger than 1 and must be fresh for every run'),
+        shard_timeout: float = typer.Option(900, help='Seconds a shard waits for the coordinator to prepare the '
+                                                      'collection, and the coordinator waits for a heartbeat of an '
+                                                      'unfinished shard, before failing'),
+        annotations_path: str = typer.Option(None, help='Optional local file metadata, either written by '
+                                                        '"export-file-info" or a GDC sample sheet. If provided, the '
+                                                        'GDC API is not queried'),
+        manifest_path: str = typer.Option(None, help='Optional GDC manifest restricting the local file metadata to '
+                                                     'the files it lists. Only used with "annotations-path"'),
+        quantize: bool = typer.Option(False, help='If True, store values as fixed point codes in the uint16 range, '
+                                                  'which BSON stores as 32 bit integers instead of doubles. Only '
+                                                  'supported for DNAm beta values, the round trip error is below '
+                                                  '1e-5'),
+        project_layout: str = typer.Option('field', help='"field" stores every project in the collection with a '
+                                                         '"project" field, "collection" writes each project to its '
+                                                         'own "<col-name>.<project>" collection'),
+        batch_size: int = typer.Option(10000, help='Number of documents per insert_many call'),
+        max_in_flight_batches: int = typer.Option(4, help='Number of batches written concurrently. As many parsed '
+                                                          'batches may wait for a writer before parsing blocks'),
+        read_ahead_chunks: int = typer.Option(8, help='Number of 1 MiB chunks of the source files read and '
+                                                      'decompressed ahead of the parser'),
+        delta: bool = typer.Option(False, help='If True, only (re)ingest patients whose source file id or checksum '
+                                               'changed since the last run, replacing all their documents, and delete '
+                                               'patients that are no longer in the release')
+):
+    col_name = col_name or subject
+    if not 0 <= shard_index < shard_count:
+        raise typer.BadParameter(f'shard-index must be in [0, {shard_count})')
+    if shard_count > 1 and not run_id:
+        raise typer.BadParameter('run-id is required when shard-count is larger than 1')
+    for option, value in [('batch-size', batch_size), ('max-in-flight-batches', max_in_flight_batches),
+                          ('read-ahead-chunks', read_ahead_chunks)]:
+        if value < 1:
+            raise typer.BadParameter(f'{option} must be at least 1')
+    from scripts.ingestion import inserters
+
+    indexes = None
+    if indexes_file:
+        with open(indexes_file) as f:
+            indexes = json.load(f)
+    inserter = inserters[subject]
+    inserter(
+        subject=subject,
+        base_dir=base_dir,
+        mongo_connection_string=mongo_connection_string,
+        db_name=db_name,
+        col_name=col_name,
+        override=override,
+        indexes=indexes,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        run_id=run_id,
+        shard_timeout=shard_timeout,
+        annotations_path=annotations_path,
+        manifest_path=manifest_path,
+        quantize=quantize,
+        project_layout=project_layout,
+        batch_size=batch_size,
+        max_in_flight_batches=max_in_flight_batches,
+        read_ahead_chunks=read_ahead_chunks,
+        delta=delta
+    )
+
+
+def export_file_info(subject: str = typer.Option(..., help='Omics data type, e.g.: ["mRNA", "DNAm", "miRNA"]'),
+                     output_path: str = typer.Option(..., help='Path to write the file metadata TSV to')):
+    from loguru import logger
+
+    from scripts.ingestion import request_gdc_file_info, subjects
+
+    df = request_gdc_file_info(data_type=subjects[subject])
+    df['experimental_strategy'] = subjects[subject]
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(output_path, sep='\t', index=False)
+    logger.info(f'Wrote metadata for {len(df)} files to {output_path}')
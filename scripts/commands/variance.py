@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import typer
+
+
+def generate_variance_table(mongo_connection_string: str = typer.Option(..., help='MongoDB connection string'),
+                            db_name: str = typer.Option(..., help='Database name'),
+                            col_name: str = typer.Option(..., help='Collection to compute variance on'),
+                            output_path: str = typer.Option(None,
+                                                            help="Path to output the resulting variance table. If "
+                                                                 "None, will be printed to stdout and returned"),
+                            override: bool = typer.Option(False,
+                                                          help='If True, will override existing variance table with '
+                                                               'the same name'),
+                            names_file: str = typer.Option(None,
+                                                           help='Path to a preprocessed name file. Used in cases '
+                                                                'where it takes too long to fetch the features for '
+                                                                'the collection'),
+                            by_project: bool = typer.Option(False,
+                                                            help='If True, add a "project" column with a row for every '
+                                                                 '(name, project) and a "pooled" row per name, together '
+                                                                 'with "count" and "mean", computed in a single pass '
+                                                                 'over the collection')):
+    """
+    Writes the sample variance (ddof=1) of every name to a tab separated table indexed by name with a "Var" column.
+    """
+    import pandas as pd
+    from loguru import logger
+    from pymongo import MongoClient
+    from tqdm import tqdm
+
+    from scripts.project_stats import get_variance_by_project, project_collection_names
+    from scripts.quantization import dequantize, get_collection_encoding
+
+    def get_values_for_name(name: str):
+        frames = []
+        for collection_name in collection_names:
+            df = pd.DataFrame(db[collection_name].find({'name': name}))
+            if encodings[collection_name] and 'value' in df:
+                df['value'] = dequantize(df['value'], encodings[collection_name])
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['value'])
+
+    p = Path(output_path)
+    if p.exists() and not override:
+        df = pd.read_csv(p, sep='\t')
+        logger.debug(df.head())
+        return df
+    p.parent.mkdir(parents=True, exist_ok=True)
+
+    with MongoClient(mongo_connection_string) as client:
+        logger.debug(client.server_info())
+        db = client[db_name]
+        if by_project:
+            df = get_variance_by_project(db, col_name, ddof=1).rename(columns={'var': 'Var'})
+        else:
+            collection_names = project_collection_names(db, col_name)
+            encodings = {name: get_collection_encoding(db, name) for name in collection_names}
+            if names_file:
+                with open(names_file) as f:
+                    names = f.read().split('\n')
+
+            else:
+                names = sorted(set().union(*[db[name].distinct('name') for name in collection_names]))
+            df = pd.DataFrame([{'name': name, 'Var': get_values_for_name(name=name).value.var()} for name in
+                               tqdm(names)])
+
+    df = df.set_index('name')
+    df.index.name = None
+
+    df.to_csv(p, sep='\t')
+    logger.debug(df.head())
+    return df
+
+
+def compute_variance(subject: str = typer.Option(..., help='Omics data type, e.g.: ["mRNA", "DNAm", "miRNA"]',
+                                    prompt_required=True),
+                    base_dir: str = typer.Option(...,
+                                     help='Directory in which the downloaded files are located at. Should '
+                                          'conform with the files downloaded from the GDC manifest',
+                                     prompt_required=True),
+                    file_extension: str = typer.Option(..., 
+                                                       help='Extension of the files that should be seeked'),
+                    output_file: str = typer.Option(..., help='Pathway to output the variace compute file')
+                    ):
+    from scripts.variance import variance_computers
+
+    variance_computers[subject](base_dir=base_dir, ext=file_extension, output_path=output_file)
@@ -0,0 +1,194 @@
+import csv
+import os.path
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import *
+
+from loguru import logger
+
+PARTIAL_SUFFIX = '.partial'
+
+
+class Segment:
+    """
+    A manifest being downloaded by a single gdc-client process. Progress is measured from the files on disk against
+    the ``size`` column of the manifest. gdc-client writes a file to ``<filename>.partial`` and renames it once the
+    download completes, so partial files count towards progress but only the final name marks a file as complete.
+    """
+
+    def __init__(self, manifest_path: Path, fieldnames: List[str], files: List[dict]):
+        self.manifest_path = manifest_path
+        self.fieldnames = fieldnames
+        self.files = files
+        self.total_bytes = sum(int(f['size']) for f in files)
+        self.process: Optional[subprocess.Popen] = None
+        self.started: Optional[float] = None
+        self.finished = False
+        self.bytes_done = 0
+        self.rate = 0.
+        self.last_line = ''
+
+    @classmethod
+    def from_manifest(cls, manifest_path: Path) -> 'Segment':
+        with open(manifest_path, newline='') as f:
+            reader = csv.DictReader(f, delimiter='\t')
+            return cls(manifest_path, reader.fieldnames, list(reader))
+
+    def write(self, manifest_path: Path):
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(manifest_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(self.files)
+        self.manifest_path = manifest_path
+
+    @staticmethod
+    def downloaded_bytes(file: dict, output_directory: str) -> int:
+        path = os.path.join(output_directory, file['id'], file['filename'])
+        sizes = [os.path.getsize(p) for p in (path, f'{path}{PARTIAL_SUFFIX}') if os.path.isfile(p)]
+        return min(max(sizes), int(file['size'])) if sizes else 0
+
+    @staticmethod
+    def is_complete(file: dict, output_directory: str) -> bool:
+        path = os.path.join(output_directory, file['id'], file['filename'])
+        return os.path.isfile(path) and os.path.getsize(path) >= int(file['size'])
+
+    def remaining_files(self, output_directory: str) -> List[dict]:
+        return [f for f in self.files if not self.is_complete(f, output_directory)]
+
+    def update(self, output_directory: str, elapsed: float, smoothing: float = 0.3):
+        bytes_done = sum(self.downloaded_bytes(f, output_directory) for f in self.files)
+        if self.process is not None and elapsed > 0:
+            rate = max(bytes_done - self.bytes_done, 0) / elapsed
+            self.rate = rate if self.rate == 0 else smoothing * rate + (1 - smoothing) * self.rate
+        self.bytes_done = bytes_done
+
+    @property
+    def eta(self) -> float:
+        return (self.total_bytes - self.bytes_done) / self.rate if self.rate > 0 else float('inf')
+
+
+class DownloadSupervisor:
+    """
+    Runs gdc-client on a set of manifest segments with at most ``number_of_concurrent_downloads`` processes at a
+    time, capturing their output and periodically reporting overall throughput and ETA. Once no segments are left to
+    start and a slot is idle, the running segment with the longest ETA has its process stopped and its remaining files
+    split into new segments, so a single slow connection does not hold up the end of the download.
+    """
+
+    def __init__(self, manifest_paths: List[Path], output_directory: str, number_of_concurrent_downloads: int,
+                 report_interval: float = 10., split_stragglers: bool = True, straggler_grace: float = 60.,
+                 min_split_eta: float = 120.):
+        self.segments = [Segment.from_manifest(path) for path in manifest_paths]
+        self.output_directory = output_directory
+        self.number_of_concurrent_downloads = number_of_concurrent_downloads
+        self.report_interval = report_interval
+        self.split_stragglers = split_stragglers
+        self.straggler_grace = straggler_grace
+        self.min_split_eta = min_split_eta
+        self.total_bytes = sum(segment.total_bytes for segment in self.segments)
+        self.resplit_directory = Path(output_directory).joinpath('.resplit')
+        self._n_resplits = 0
+
+    def start(self, segment: Segment):
+        segment.process = subprocess.Popen(
+            ['gdc-client', 'download', '-m', str(segment.manifest_path), '-d', self.output_directory, '--debug'],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        segment.started = time.monotonic()
+        threading.Thread(target=self.consume_output, args=(segment,), daemon=True).start()
+        logger.info(f'Started {segment.manifest_path.name}: {len(segment.files)} files, {segment.total_bytes} bytes')
+
+    @staticmethod
+    def consume_output(segment: Segment):
+        for line in segment.process.stdout:
+            line = line.strip()
+            if line:
+                segment.last_line = line
+                logger.debug(f'{segment.manifest_path.name}: {line}')
+
+    def split(self, segment: Segment, n_parts: int) -> List[Segment]:
+        segment.process.terminate()
+        segment.process.wait()
+        remaining = segment.remaining_files(self.output_directory)
+        segment.files = [f for f in segment.files if f not in remaining]
+        segment.total_bytes = sum(int(f['size']) for f in segment.files)
+        segment.finished = True
+        segment.update(self.output_directory, elapsed=0)
+
+        # Balance the parts by size, largest files first
+        parts = [[] for _ in range(min(n_parts, len(remaining)))]
+        for file in sorted(remaining, key=lambda f: int(f['size']), reverse=True):
+            min(parts, key=lambda part: sum(int(f['size']) for f in part)).append(file)
+
+        new_segments = []
+        for part in parts:
+            new_segment = Segment(segment.manifest_path, segment.fieldnames, part)
+            new_segment.update(self.output_directory, elapsed=0)
+            new_segment.write(self.resplit_directory.joinpath(
+                f'{segment.manifest_path.stem}_r{self._n_resplits}.txt'))
+            self._n_resplits += 1
+            new_segments.append(new_segment)
+        logger.info(f'Split straggler {segment.manifest_path.name} into {len(new_segments)} segments with '
+                    f'{len(remaining)} remaining files')
+        return new_segments
+
+    def find_straggler(self, running: List[Segment]) -> Optional[Segment]:
+        now = time.monotonic()
+        candidates = [segment for segment in running if now - segment.started > self.straggler_grace and
+                      segment.eta > self.min_split_eta and
+                      len(segment.remaining_files(self.output_directory)) > 1]
+        return max(candidates, key=lambda segment: segment.eta, default=None)
+
+    def report(self, throughput: float):
+        bytes_done = sum(segment.bytes_done for segment in self.segments)
+        remaining = self.total_bytes - bytes_done
+        eta = f'{remaining / throughput / 60:.1f}min' if throughput > 0 else 'unknown'
+        logger.info(f'{bytes_done / 2 ** 30:.2f}/{self.total_bytes / 2 ** 30:.2f}GiB '
+                    f'({bytes_done / max(self.total_bytes, 1):.1%}), {throughput / 2 ** 20:.2f}MiB/s, ETA {eta}')
+
+    def run(self):
+        pending = deque(self.segments)
+        running: List[Segment] = []
+        for segment in self.segments:
+            segment.update(self.output_directory, elapsed=0)
+        throughput = 0.
+        last = time.monotonic()
+
+        while pending or running:
+            while pending and len(running) < self.number_of_concurrent_downloads:
+                segment = pending.popleft()
+                self.start(segment)
+                running.append(segment)
+
+            time.sleep(self.report_interval)
+            now = time.monotonic()
+            bytes_before = sum(segment.bytes_done for segment in self.segments)
+            for segment in running:
+                segment.update(self.output_directory, elapsed=now - last)
+            rate = (sum(segment.bytes_done for segment in self.segments) - bytes_before) / (now - last)
+            throughput = rate if throughput == 0 else 0.3 * rate + 0.7 * throughput
+            last = now
+
+            for segment in [segment for segment in running if segment.process.poll() is not None]:
+                running.remove(segment)
+                segment.finished = True
+                incomplete = segment.remaining_files(self.output_directory)
+                if incomplete:
+                    logger.warning(f'{segment.manifest_path.name} exited with code {segment.process.returncode} '
+                                   f'and {len(incomplete)} incomplete files. Last output: {segment.last_line}')
+                else:
+                    logger.info(f'Finished {segment.manifest_path.name}')
+
+            idle = self.number_of_concurrent_downloads - len(running)
+            if self.split_stragglers and not pending and idle > 0:
+                straggler = self.find_straggler(running)
+                if straggler is not None:
+                    running.remove(straggler)
+                    new_segments = self.split(straggler, n_parts=idle + 1)
+                    self.segments.extend(new_segments)
+                    pending.extend(new_segments)
+
+            self.report(throughput)
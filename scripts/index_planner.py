@@ -0,0 +1,238 @@
+import json
+import sys
+import time
+from pathlib import Path
+from typing import *
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import typer
+from bson import json_util
+from loguru import logger
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+from scripts.project_stats import project_collection_names
+
+app = typer.Typer()
+
+QUERY_COMMANDS = ('find', 'aggregate', 'distinct', 'count')
+
+
+def load_workload(workload_path: str) -> List[dict]:
+    """
+    Reads a workload file. Every line is an extended JSON command document as it would be sent to the server, e.g.
+    ``{"find": "mRNA", "filter": {"name": "TP53"}}`` or ``{"aggregate": "DNAm", "pipeline": [...], "cursor": {}}``.
+    """
+    with open(workload_path) as f:
+        return [json_util.loads(line) for line in f if line.strip()]
+
+
+def command_collection(command: dict) -> str:
+    return next(command[key] for key in QUERY_COMMANDS if key in command)
+
+
+def find_execution_stats(explain: Any) -> List[dict]:
+    if isinstance(explain, dict):
+        if 'executionStats' in explain:
+            return [explain['executionStats']]
+        return [stats for value in explain.values() for stats in find_execution_stats(value)]
+    if isinstance(explain, list):
+        return [stats for value in explain for stats in find_execution_stats(value)]
+    return []
+
+
+def find_index_names(plan: Any) -> Set[str]:
+    if isinstance(plan, dict):
+        names = {plan['indexName']} if 'indexName' in plan else set()
+        return names.union(*[find_index_names(value) for value in plan.values()])
+    if isinstance(plan, list):
+        return set().union(*[find_index_names(value) for value in plan])
+    return set()
+
+
+def explain_command(db, command: dict, hint: Union[str, dict, None] = None) -> Optional[dict]:
+    command = {key: value for key, value in command.items() if not key.startswith('$')}
+    if hint is not None:
+        command['hint'] = hint
+    if 'aggregate' in command:
+        command.setdefault('cursor', {})
+    try:
+        explain = db.command('explain', command, verbosity='executionStats')
+    except OperationFailure as e:
+        logger.debug(f'Unable to explain {command} with hint {hint}: {e}')
+        return None
+
+    stats = find_execution_stats(explain)
+    return dict(
+        keys_examined=sum(s.get('totalKeysExamined', 0) for s in stats),
+        docs_examined=sum(s.get('totalDocsExamined', 0) for s in stats),
+        millis=sum(s.get('executionTimeMillis', 0) for s in stats),
+        indexes=find_index_names(explain)
+    )
+
+
+def collect_stats(db, workload: List[dict], candidates: Dict[str, list]) -> List[dict]:
+    """
+    Explains every query once as a collection scan and once per candidate index. Commands that do not accept a hint
+    (e.g. ``distinct`` on older servers) are explained once and credited to whichever index the planner picked.
+    """
+    records = []
+    for command in workload:
+        collscan = explain_command(db, command, hint={'$natural': 1})
+        per_index = {}
+        for name in candidates:
+            stats = explain_command(db, command, hint=name)
+            if stats is not None:
+                per_index[name] = stats
+        if collscan is None or not per_index:
+            stats = explain_command(db, command)
+            if stats is None:
+                logger.warning(f'Skipping query that could not be explained: {command}')
+                continue
+            collscan = collscan or dict(stats, keys_examined=float('inf'), docs_examined=float('inf'))
+            per_index = {name: stats for name in stats['indexes'] if name in candidates}
+        records.append(dict(command=command, collscan=collscan, per_index=per_index))
+    return records
+
+
+def recommend_indexes(records: List[dict], candidates: Dict[str, list], tolerance: float = 0.1) -> List[str]:
+    """
+    An index serves a query if it examines fewer documents and keys than a collection scan and is within
+    ``tolerance`` of the best candidate. The recommendation is a greedy cover of all queries that any index serves.
+    """
+
+    def cost(stats):
+        return stats['keys_examined'] + stats['docs_examined']
+
+    served_by = {name: set() for name in candidates}
+    for i, record in enumerate(records):
+        useful = {name: cost(stats) for name, stats in record['per_index'].items()
+                  if cost(stats) < cost(record['collscan'])}
+        if not useful:
+            continue
+        best = min(useful.values())
+        for name, c in useful.items():
+            if c <= best * (1 + tolerance):
+                served_by[name].add(i)
+
+    uncovered = set().union(*served_by.values())
+    chosen = []
+    while uncovered:
+        name = max(served_by, key=lambda n: (len(served_by[n] & uncovered), -len(candidates[n])))
+        chosen.append(name)
+        uncovered -= served_by[name]
+    return chosen
+
+
+def index_sizes(col: Collection) -> Dict[str, int]:
+    return col.database.command('collStats', col.name)['indexSizes']
+
+
+def measure_write_throughput(col: Collection, keys: List[list], sample_size: int) -> float:
+    docs = list(col.aggregate([{'$sample': {'size': sample_size}}, {'$project': {'_id': 0}}]))
+    bench = col.database[f'{col.name}__index_bench']
+    bench.drop()
+    for key in keys:
+        bench.create_index(key)
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(docs), 1000):
+            bench.insert_many([dict(doc) for doc in docs[i: i + 1000]])
+        return len(docs) / max(time.perf_counter() - start, 1e-9)
+    finally:
+        bench.drop()
+
+
+def current_candidates(col: Collection) -> Dict[str, list]:
+    return {name: [tuple(field) for field in info['key']] for name, info in col.index_information().items()
+            if name != '_id_'}
+
+
+@app.command()
+def plan(mongo_connection_string: str = typer.Option(..., help='Connection string of a local mongod holding a copy '
+                                                              'of the data'),
+         db_name: str = typer.Option(..., help='Database name'),
+         col_name: str = typer.Option(..., help='Collection to plan indexes for'),
+         workload_path: str = typer.Option(..., help='Recorded queries, one extended JSON command per line'),
+         output_path: str = typer.Option(..., help='Path to write the recommended index set to. Can be passed to '
+                                                   '"insert-data --indexes-file"'),
+         tolerance: float = typer.Option(0.1, help='Relative cost slack within which an index counts as serving a '
+                                                   'query as well as the best one'),
+         apply: bool = typer.Option(False, help='If True, drop the indexes that were not recommended and report '
+                                                'write throughput and index storage before and after'),
+         sample_size: int = typer.Option(100000, help='Number of documents used for the write throughput benchmark')):
+    with MongoClient(mongo_connection_string) as client:
+        db = client[db_name]
+        col = db[col_name]
+        partitions = [name for name in project_collection_names(db, col_name) if name != col_name]
+        if partitions and not col.estimated_document_count():
+            logger.error(f'{col_name} was written with the per-project layout, plan each of its collections '
+                         f'separately, e.g. "--col-name={partitions[0]}"')
+            raise typer.Exit(1)
+        workload = [command for command in load_workload(workload_path) if command_collection(command) == col_name]
+        candidates = current_candidates(col)
+        logger.info(f'Replaying {len(workload)} queries against {len(candidates)} candidate indexes')
+
+        records = collect_stats(db, workload, candidates)
+        if not records:
+            logger.warning(f'No query in {workload_path} could be replayed against {col_name}')
+        chosen = recommend_indexes(records, candidates, tolerance=tolerance)
+        for name in candidates:
+            logger.info(f'{name}: {"keep" if name in chosen else "drop"}')
+
+        recommended = [candidates[name] for name in chosen]
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(recommended, f, indent=2)
+
+        if not apply:
+            return recommended
+
+        # An empty recommendation means no recorded query was served by any index (or none was recorded for this
+        # collection at all), not that the collection needs no indexes
+        if not records or not chosen:
+            logger.error(f'No query in {workload_path} for {col_name} was served by an index, refusing to drop '
+                         f'indexes. Check "--col-name" and that the workload was recorded')
+            raise typer.Exit(1)
+
+        to_drop = [name for name in candidates if name not in chosen]
+        logger.info(f'Dropping {len(to_drop)} of {len(candidates)} indexes: {to_drop}')
+
+        before_sizes = index_sizes(col)
+        before_throughput = measure_write_throughput(col, list(candidates.values()), sample_size)
+        after_throughput = measure_write_throughput(col, recommended, sample_size)
+
+        for name in to_drop:
+            col.drop_index(name)
+        after_sizes = index_sizes(col)
+
+        logger.info(f'Index storage: {sum(before_sizes.values())} -> {sum(after_sizes.values())} bytes')
+        logger.info(f'Write throughput: {before_throughput:.0f} -> {after_throughput:.0f} docs/s')
+        return recommended
+
+
+@app.command()
+def record_workload(mongo_connection_string: str = typer.Option(..., help='MongoDB connection string'),
+                    db_name: str = typer.Option(..., help='Database name with profiling enabled, e.g. after '
+                                                          '"db.setProfilingLevel(2)"'),
+                    output_path: str = typer.Option(..., help='Workload file to append the profiled queries to')):
+    with MongoClient(mongo_connection_string) as client:
+        db = client[db_name]
+        with open(output_path, 'a') as f:
+            n = 0
+            for entry in db['system.profile'].find({'op': {'$in': ['query', 'command']}}):
+                command = entry.get('command', {})
+                if not any(key in command for key in QUERY_COMMANDS):
+                    continue
+                command = {key: value for key, value in command.items()
+                           if key != 'lsid' and not key.startswith('$')}
+                f.write(json_util.dumps(command) + '\n')
+                n += 1
+    logger.info(f'Recorded {n} queries to {output_path}')
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,662 @@
+import csv
+import hashlib
+import os.path
+import queue
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing
+from io import StringIO
+from pathlib import Path
+from typing import *
+
+import pandas as pd
+import pymongo
+import requests
+from loguru import logger
+from pymongo import IndexModel
+from tqdm import tqdm
+
+from scripts.project_stats import project_collection_names
+from scripts.quantization import UINT16_ENCODING, get_collection_encoding, quantize, set_collection_encoding
+from scripts.sources import file_key, iter_source_files, stream_files
+
+
+DEFAULT_INDEXES = [[('name', pymongo.ASCENDING)],
+                   [('patient', pymongo.ASCENDING)],
+                   [('sample', pymongo.ASCENDING)],
+                   [('patient', pymongo.ASCENDING), ('name', pymongo.ASCENDING)],
+                   [('sample', pymongo.ASCENDING), ('name', pymongo.ASCENDING)],
+                   [('sample', pymongo.ASCENDING), ('patient', pymongo.ASCENDING)]
+                   ]
+PROJECT_INDEX = [('project', pymongo.ASCENDING), ('name', pymongo.ASCENDING)]
+PROJECT_LAYOUTS = ('field', 'collection')
+SHARDS_COLLECTION = '_ingestion_shards'
+FILES_COLLECTION = '_ingested_files'
+DELTA_INDEX = [('patient', pymongo.ASCENDING)]
+
+
+def shard_of(patient: str, shard_count: int) -> int:
+    return int(hashlib.md5(patient.encode('utf-8')).hexdigest(), 16) % shard_count
+
+
+class ShardCoordinator:
+    """
+    Coordinates several ``insert-data`` processes writing to the same collection through a record in
+    ``SHARDS_COLLECTION``. Shard 0 is the coordinator: it creates the record with a fresh token, prepares the collection
+    and marks it as ready, while every other shard waits for that before touching the collection. Every shard claims its
+    index in ``joined`` atomically and fails if it is already taken, so a reused run id is rejected by every shard
+    instead of letting it insert its patients a second time.
+
+    ``settings`` that change how documents are written, e.g. the project layout, are stored in the record by the
+    coordinator, and every other shard fails if its own differ.
+
+    Shards increment a heartbeat counter while inserting and add themselves to ``finished`` when done. The coordinator
+    waits for all of them and fails if an unfinished shard's heartbeat does not change for ``timeout`` seconds.
+    """
+
+    def __init__(self, db, col_name: str, run_id: str, shard_index: int, shard_count: int,
+                 poll_interval: float = 5., timeout: float = 900., settings: dict = None):
+        self.record_id = f'{col_name}:{run_id}'
+        self.settings = settings or {}
+        self.shards = db[SHARDS_COLLECTION]
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.token: Optional[str] = None
+        self._last_heartbeat = 0.
+
+    @property
+    def is_coordinator(self) -> bool:
+        return self.shard_index == 0
+
+    def _reused_run_error(self) -> ValueError:
+        return ValueError(f'{self.record_id} belongs to an earlier run, pass a fresh run id')
+
+    def start(self):
+        if self.is_coordinator:
+            record = self.shards.find_one({'_id': self.record_id})
+            # A record that is not ready yet is left over from a coordinator that failed while preparing, which is safe
+            # to restart since no other shard has started inserting
+            if record is not None and (record['ready'] or record['finished']):
+                raise self._reused_run_error()
+            self.token = uuid.uuid4().hex
+            self.shards.replace_one({'_id': self.record_id},
+                                    {'token': self.token, 'shard_count': self.shard_count, 'ready': False,
+                                     'settings': self.settings, 'joined': [self.shard_index], 'finished': [],
+                                     'heartbeats': {}},
+                                    upsert=True)
+
+    def mark_ready(self):
+        self.shards.update_one({'_id': self.record_id, 'token': self.token}, {'$set': {'ready': True}})
+
+    def wait_until_ready(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            record = self.shards.find_one({'_id': self.record_id})
+            if record is not None and record['finished']:
+                raise self._reused_run_error()
+            if record is not None and record['ready']:
+                if record['shard_count'] != self.shard_count:
+                    raise ValueError(f'Shard count mismatch for {self.record_id}: coordinator uses '
+                                     f'{record["shard_count"]}, this shard uses {self.shard_count}')
+                if record.get('settings', {}) != self.settings:
+                    raise ValueError(f'Settings mismatch for {self.record_id}: coordinator uses '
+                                     f'{record.get("settings", {})}, this shard uses {self.settings}')
+                claimed = self.shards.find_one_and_update(
+                    {'_id': self.record_id, 'token': record['token'], 'joined': {'$ne': self.shard_index}},
+                    {'$addToSet': {'joined': self.shard_index}})
+                if claimed is None:
+                    raise self._reused_run_error()
+                self.token = record['token']
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Coordinator of {self.record_id} was not ready within {self.timeout}s')
+            logger.info(f'Shard {self.shard_index} waiting for the coordinator of {self.record_id}')
+            time.sleep(self.poll_interval)
+
+    def heartbeat(self):
+        now = time.monotonic()
+        if now - self._last_heartbeat < self.poll_interval:
+            return
+        self._last_heartbeat = now
+        self.shards.update_one({'_id': self.record_id, 'token': self.token},
+                               {'$inc': {f'heartbeats.{self.shard_index}': 1}})
+
+    def mark_finished(self) -> int:
+        record = self.shards.find_one_and_update({'_id': self.record_id, 'token': self.token},
+                                                 {'$addToSet': {'finished': self.shard_index}},
+                                                 return_document=pymongo.ReturnDocument.AFTER)
+        if record is None:
+            raise ValueError(f'{self.record_id} was replaced by another run while shard {self.shard_index} was running')
+        n_finished = len(record['finished'])
+        logger.info(f'Shard {self.shard_index} finished, {n_finished}/{self.shard_count} shards done')
+        return n_finished
+
+    def wait_for_all(self):
+        last_seen = {}
+        while True:
+            record = self.shards.find_one({'_id': self.record_id})
+            if len(record['finished']) >= self.shard_count:
+                break
+            now = time.monotonic()
+            stale = []
+            for shard in range(self.shard_count):
+                if shard in record['finished']:
+                    continue
+                beats = record.get('heartbeats', {}).get(str(shard), 0)
+                if shard not in last_seen or last_seen[shard][0] != beats:
+                    last_seen[shard] = (beats, now)
+                elif now - last_seen[shard][1] > self.timeout:
+                    stale.append(shard)
+            if stale:
+                raise RuntimeError(f'Shards {stale} of {self.record_id} sent no heartbeat for {self.timeout}s and '
+                                   f'did not finish')
+            time.sleep(self.poll_interval)
+        logger.info(f'All {self.shard_count} shards of {self.record_id} finished')
+
+
+def request_gdc_file_info(data_type: str) -> pd.DataFrame:
+    fields = [
+        "file_name",
+        "md5sum",
+        "cases.submitter_id",
+        "cases.samples.sample_type",
+        "cases.project.project_id",
+        "cases.project.primary_site",
+    ]
+
+    fields = ",".join(fields)
+
+    files_endpt = "https://api.gdc.cancer.gov/files"
+
+    filters = {
+        "op": "and",
+        "content": [
+            {
+                "op": "in",
+                "content": {
+                    "field": "files.experimental_strategy",
+                    "value": [data_type]
+                }
+            }
+        ]
+    }
+
+    params = {
+        "filters": filters,
+        "fields": fields,
+        "format": "TSV",
+        "size": "200000"
+    }
+
+    response = requests.post(
+        files_endpt,
+        headers={"Content-Type": "application/json"},
+        json=params)
+
+    df = pd.read_csv(StringIO(response.content.decode("utf-8")), sep="\t")
+    return df
+
+
+SAMPLE_SHEET_COLUMNS = {'File ID': 'id',
+                        'File Name': 'file_name',
+                        'Case ID': 'cases.0.submitter_id',
+                        'Sample Type': 'cases.0.samples.0.sample_type',
+                        'Project ID': 'cases.0.project.project_id'}
+FILE_INFO_COLUMNS = ['id', 'file_name', 'md5sum', 'cases.0.submitter_id', 'cases.0.samples.0.sample_type',
+                     'cases.0.project.project_id', 'cases.0.project.primary_site']
+
+
+def read_local_file_info(annotations_path: str, manifest_path: str = None, data_type: str = None) -> pd.DataFrame:
+    """
+    Builds the same table as ``request_gdc_file_info`` without network access. ``annotations_path`` is either a TSV
+    written by the ``export-file-info`` command or a GDC sample sheet. If ``manifest_path`` is given, only files listed
+    in the manifest are kept and their checksums are taken from its ``md5`` column. Rows are only filtered by
+    ``data_type`` if the annotations have an ``experimental_strategy`` column.
+    """
+    annotations = pd.read_csv(annotations_path, sep='\t', dtype=str)
+    annotations = annotations.rename(columns=SAMPLE_SHEET_COLUMNS)
+    if 'experimental_strategy' in annotations.columns and data_type is not None:
+        annotations = annotations[annotations['experimental_strategy'] == data_type]
+    for col in FILE_INFO_COLUMNS:
+        if col not in annotations.columns:
+            annotations[col] = None
+    # Sample sheets list every case of a multi-case file separated by commas
+    annotations['cases.0.submitter_id'] = annotations['cases.0.submitter_id'].str.split(',').str[0].str.strip()
+    annotations['cases.0.samples.0.sample_type'] = \
+        annotations['cases.0.samples.0.sample_type'].str.split(',').str[0].str.strip()
+    annotations = annotations[FILE_INFO_COLUMNS].drop_duplicates(subset=['id']).set_index('id')
+
+    if manifest_path is None:
+        return annotations.reset_index()
+
+    manifest = pd.read_csv(manifest_path, sep='\t', usecols=lambda c: c in ('id', 'filename', 'md5'),
+                           dtype=str).set_index('id')
+    df = manifest.join(annotations, how='inner')
+    df['file_name'] = df.pop('filename')
+    if 'md5' in df.columns:
+        df['md5sum'] = df.pop('md5')
+    missing = len(manifest) - len(df)
+    if missing:
+        logger.warning(f'{missing} manifest files have no annotation in {annotations_path}')
+    return df.reset_index()[FILE_INFO_COLUMNS]
+
+
+def insert_batch(col, docs: List[dict]):
+    col.insert_many(docs)
+
+
+class BatchWriter:
+    """
+    Writes batches of documents with ``write`` on ``max_in_flight`` background threads. At most ``max_in_flight``
+    further batches wait in the queue, so the caller blocks instead of buffering when the database falls behind. Errors
+    raised by a writer are re-raised on the next ``submit`` or on ``close``.
+    """
+
+    def __init__(self, max_in_flight: int = 4):
+        if max_in_flight < 1:
+            raise ValueError(f'max_in_flight must be at least 1, got {max_in_flight}')
+        self._batches = queue.Queue(maxsize=max_in_flight)
+        self._error: Optional[BaseException] = None
+        self._threads = [threading.Thread(target=self._write, daemon=True) for _ in range(max_in_flight)]
+        for thread in self._threads:
+            thread.start()
+
+    def _write(self):
+        while True:
+            item = self._batches.get()
+            if item is None:
+                return
+            col, docs = item
+            try:
+                if self._error is None:
+                    insert_batch(col, docs)
+            except BaseException as e:
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, col, docs: List[dict]):
+        self._raise_error()
+        self._batches.put((col, docs))
+
+    def close(self, raise_error: bool = True):
+        """
+        Waits for the queued batches to be written. Pass ``raise_error=False`` while another exception is propagating,
+        so a writer error does not replace it.
+        """
+        for _ in self._threads:
+            self._batches.put(None)
+        for thread in self._threads:
+            thread.join()
+        if raise_error:
+            self._raise_error()
+
+
+class AbstractDatabaseInserter(ABC):
+    # Encoding used for the values when inserting with quantize=True, None if the subject does not support it
+    quantized_encoding: Optional[dict] = None
+
+    def __init__(self,
+                 subject: str,
+                 base_dir: str,
+                 mongo_connection_string: str,
+                 db_name: str,
+                 col_name: str,
+                 override: bool = False,
+                 indexes: List[List[Tuple[str, int]]] = None,
+                 shard_index: int = 0,
+                 shard_count: int = 1,
+                 run_id: str = None,
+                 shard_timeout: float = 900.,
+                 annotations_path: str = None,
+                 manifest_path: str = None,
+                 quantize: bool = False,
+                 project_layout: str = 'field',
+                 batch_size: int = 10000,
+                 max_in_flight_batches: int = 4,
+                 read_ahead_chunks: int = 8,
+                 delta: bool = False):
+        if delta and override:
+            raise ValueError('Delta ingestion updates the existing collection and cannot be combined with override')
+        if quantize and self.quantized_encoding is None:
+            raise ValueError(f'Quantized values are not supported for {subject}')
+        if project_layout not in PROJECT_LAYOUTS:
+            raise ValueError(f'Unknown project layout {project_layout}, expected one of {PROJECT_LAYOUTS}')
+        for name, value in [('batch_size', batch_size), ('max_in_flight_batches', max_in_flight_batches),
+                            ('read_ahead_chunks', read_ahead_chunks)]:
+            if value < 1:
+                raise ValueError(f'{name} must be at least 1, got {value}')
+        self.encoding = self.quantized_encoding if quantize else None
+        self.subject = subject
+        self.base_dir = base_dir
+        self.mongo_connection_string = mongo_connection_string
+        self.db_name = db_name
+        self.annotations_path = annotations_path
+        self.manifest_path = manifest_path
+        self.batch_size = batch_size
+
+        self.info = self.request_file_info(data_type=subjects[self.subject])
+        logger.debug(self.info.head())
+        self.patient_project_map = dict(zip(self.info['cases.0.submitter_id'], self.info['cases.0.project.project_id']))
+        self.patient_source_map = {row['cases.0.submitter_id']: {'file_id': row.id,
+                                                                 'md5sum': row.md5sum if isinstance(row.md5sum, str)
+                                                                 else None}
+                                   for _, row in self.info.iterrows()}
+        self.patient_file_map = {patient: file_path for patient, file_path in
+                                 self.make_patient_file_map(self.info, base_dir).items()
+                                 if shard_of(patient, shard_count) == shard_index}
+        client = pymongo.MongoClient(mongo_connection_string)
+        logger.debug(client.server_info())
+        db = client[db_name]
+        self.col = db[col_name]
+        self.files = db[FILES_COLLECTION]
+        # With the "collection" layout every project is written to its own "<col_name>.<project>" collection, with the
+        # "field" layout everything goes to "col_name" and per-project queries use the (project, name) index
+        if project_layout == 'collection':
+            projects = sorted(self.info['cases.0.project.project_id'].dropna().unique())
+            self.project_collections = {project: db[f'{col_name}.{project}'] for project in projects}
+        else:
+            self.project_collections = {None: self.col}
+            if indexes is None:
+                indexes = DEFAULT_INDEXES + [PROJECT_INDEX]
+
+        coordinator = ShardCoordinator(db, col_name, run_id, shard_index, shard_count, timeout=shard_timeout,
+                                       settings=dict(project_layout=project_layout)) if shard_count > 1 else None
+        if coordinator is None or coordinator.is_coordinator:
+            if coordinator is not None:
+                coordinator.start()
+            keys = [[tuple(field) for field in key] for key in (DEFAULT_INDEXES if indexes is None else indexes)]
+            # Delta ingestion deletes the documents of changed and removed patients, any index led by patient serves it
+            if delta and not any(key[0][0] == 'patient' for key in keys):
+                keys.append(DELTA_INDEX)
+            indexes = [IndexModel(key) for key in keys]
+            if override:
+                self.files.delete_many({'collection': col_name})
+            self.files.create_index([('collection', pymongo.ASCENDING), ('patient', pymongo.ASCENDING)], unique=True)
+            for col in self.project_collections.values():
+                if override:
+                    col.drop()
+                existing_encoding = get_collection_encoding(db, col.name)
+                if existing_encoding != self.encoding and col.estimated_document_count():
+                    raise ValueError(f'{col.name} is stored with encoding {existing_encoding}, cannot insert values '
+                                     f'with encoding {self.encoding}')
+                set_collection_encoding(db, col.name, self.encoding)
+                if indexes:
+                    col.create_indexes(indexes)
+            if coordinator is not None:
+                coordinator.mark_ready()
+        else:
+            coordinator.wait_until_ready()
+            for col in self.project_collections.values():
+                existing_encoding = get_collection_encoding(db, col.name)
+                if existing_encoding != self.encoding:
+                    raise ValueError(f'The coordinator prepared {col.name} with encoding {existing_encoding}, this '
+                                     f'shard inserts values with encoding {self.encoding}')
+
+        self.stale_collections: Dict[str, List[str]] = {}
+        if delta:
+            self.patient_file_map = self.apply_release_changes(col_name, shard_index, shard_count)
+        elif not override:
+            existing_patients = set().union(*[col.distinct('patient') for col in self.project_collections.values()])
+            self.patient_file_map = {key: value for key, value in self.patient_file_map.items() if
+                                     key not in existing_patients}
+
+        # Files are read and decompressed in chunks on a reader thread, parsed here as they stream in and written in
+        # batches by the writer threads, so disk, CPU and database round trips overlap. Whatever the file sizes, memory
+        # is bounded by read_ahead_chunks chunks and 2 * max_in_flight_batches batches of batch_size documents.
+        key_patient_map = {file_key(file_path): patient for patient, file_path in self.patient_file_map.items()}
+        inserted = set()
+        self.writer = BatchWriter(max_in_flight=max_in_flight_batches)
+        files = stream_files(iter_source_files(base_dir, lambda n: file_key(n) in key_patient_map),
+                             max_chunks=read_ahead_chunks)
+        try:
+            with closing(files):
+                for name, f in tqdm(files, total=len(key_patient_map)):
+                    patient = key_patient_map[file_key(name)]
+                    if coordinator is not None:
+                        coordinator.heartbeat()
+                    if patient in inserted:
+                        continue
+                    self.remove_stale_documents(col_name, patient)
+                    self.insert_patient_data(patient=patient, f=f)
+                    inserted.add(patient)
+        except BaseException:
+            self.writer.close(raise_error=False)
+            raise
+        self.writer.close()
+        self.record_sources(col_name, inserted)
+
+        for patient, file_path in self.patient_file_map.items():
+            if patient not in inserted:
+                logger.error(f'Unable to insert files for {patient}:{file_path}')
+
+        if coordinator is not None:
+            coordinator.mark_finished()
+            if coordinator.is_coordinator:
+                coordinator.wait_for_all()
+
+    @abstractmethod
+    def parse_patient_data(self, patient: str, f: TextIO) -> Iterator[dict]:
+        ...
+
+    def collection_for(self, project: Optional[str]):
+        if None in self.project_collections or project is None:
+            return self.col
+        # Projects that left the release still have their collection from earlier runs
+        return self.project_collections.get(project) or self.col.database[f'{self.col.name}.{project}']
+
+    def insert_patient_data(self, patient: str, f: TextIO):
+        project = self.patient_project_map.get(patient)
+        col = self.collection_for(project)
+        batch = []
+        for sample in self.parse_patient_data(patient=patient, f=f):
+            sample['project'] = project
+            batch.append(sample)
+            if len(batch) == self.batch_size:
+                self.writer.submit(col, batch)
+                batch = []
+        if batch:
+            self.writer.submit(col, batch)
+
+    def apply_release_changes(self, col_name: str, shard_index: int, shard_count: int) -> Dict[str, str]:
+        """
+        Compares the release with the files recorded in ``FILES_COLLECTION`` by earlier runs. Patients of this shard
+        that left the release are deleted. Patients found in the collection(s) without a record, e.g. loaded before
+        files were recorded or by an interrupted run, count as changed. Returns the part of ``patient_file_map`` that
+        needs to be (re)ingested: new and changed patients. The documents of a changed patient are kept until its new
+        file is found, see ``remove_stale_documents``.
+        """
+        loaded = {}
+        for name in project_collection_names(self.col.database, col_name):
+            project = name[len(col_name) + 1:] if name != col_name else None
+            for patient in self.col.database[name].distinct('patient'):
+                if shard_of(patient, shard_count) == shard_index:
+                    loaded[patient] = {'patient': patient, 'project': project, 'file_id': None, 'md5sum': None}
+        loaded.update({record['patient']: record for record in self.files.find({'collection': col_name})
+                       if shard_of(record['patient'], shard_count) == shard_index})
+
+        removed = [patient for patient in loaded if patient not in self.patient_file_map]
+        if removed:
+            self.files.delete_many({'collection': col_name, 'patient': {'$in': removed}})
+        removed_by_collection = {}
+        for patient in removed:
+            name = self.collection_for(loaded[patient].get('project')).name
+            removed_by_collection.setdefault(name, []).append(patient)
+        for name, patients in removed_by_collection.items():
+            self.col.database[name].delete_many({'patient': {'$in': patients}})
+
+        changed = {}
+        for patient, file_path in self.patient_file_map.items():
+            source = self.patient_source_map.get(patient, {})
+            record = loaded.get(patient)
+            if record is not None and record['file_id'] == source.get('file_id') and \
+                    record.get('md5sum') == source.get('md5sum'):
+                continue
+            changed[patient] = file_path
+            if record is not None:
+                projects = {record.get('project'), self.patient_project_map.get(patient)}
+                self.stale_collections[patient] = sorted({self.collection_for(project).name for project in projects})
+
+        logger.info(f'Delta ingestion: {len(changed)} new or changed, {len(removed)} removed, '
+                    f'{len(self.patient_file_map) - len(changed)} unchanged patients')
+        return changed
+
+    def remove_stale_documents(self, col_name: str, patient: str):
+        """
+        Deletes the documents of a changed patient right before its new file is inserted, so patients whose new file
+        is missing keep their data. The record goes first, so an interrupted run reloads the patient again.
+        """
+        names = self.stale_collections.get(patient)
+        if not names:
+            return
+        self.files.delete_one({'collection': col_name, 'patient': patient})
+        for name in names:
+            self.col.database[name].delete_many({'patient': patient})
+
+    def record_sources(self, col_name: str, patients: Iterable[str]):
+        patients = list(patients)
+        for i in range(0, len(patients), self.batch_size):
+            batch = patients[i: i + self.batch_size]
+            self.files.delete_many({'collection': col_name, 'patient': {'$in': batch}})
+            self.files.insert_many([{'collection': col_name, 'patient': patient,
+                                     'project': self.patient_project_map.get(patient),
+                                     **self.patient_source_map.get(patient, {'file_id': None, 'md5sum': None})}
+                                    for patient in batch])
+
+    def request_file_info(self, data_type: str) -> pd.DataFrame:
+        if self.annotations_path:
+            return read_local_file_info(annotations_path=self.annotations_path, manifest_path=self.manifest_path,
+                                        data_type=data_type)
+        return request_gdc_file_info(data_type=data_type)
+
+    @staticmethod
+    def make_patient_file_map(df, base_dir):
+        return {row['cases.0.submitter_id']: os.path.join(
+            base_dir, row.id, row.file_name)
+            for _, row in df.iterrows()}
+
+
+class mRNADatabaseInserter(AbstractDatabaseInserter):
+    def parse_patient_data(self, patient: str, f: TextIO) -> Iterator[dict]:
+        reader = csv.reader(f, delimiter='\t')
+        columns = None
+        for i, row in enumerate(reader):
+            if i == 1:
+                columns = row
+            if i < 6:
+                continue
+            yield {'name': row[1], 'value': float(row[-1]), 'patient': patient,
+                   'metadata': {columns[0]: row[0],
+                                columns[2]: row[2],
+                                columns[4]: row[4],
+                                columns[5]: row[5],
+                                columns[6]: row[6],
+                                columns[7]: row[7],
+                                }
+                   }
+
+    def request_file_info(self, data_type) -> pd.DataFrame:
+        df = super().request_file_info(data_type=data_type)
+        df = df[
+            df['cases.0.project.project_id'].str.startswith('TCGA')]
+        df = df[
+            df['file_name'].str.endswith('rna_seq.augmented_star_gene_counts.tsv')]
+        df = df[
+            df['cases.0.samples.0.sample_type'] == 'Primary Tumor']
+
+        # When there is more than one file for a single patient just keep the first
+        # (this is assuming they are just replicates and all similar)
+        df = df[~df.duplicated(
+            subset=['cases.0.submitter_id'], keep='first')]
+
+        return df
+
+
+class miRNADatabaseInserter(AbstractDatabaseInserter):
+    def parse_patient_data(self, patient: str, f: TextIO) -> Iterator[dict]:
+        reader = csv.reader(f, delimiter='\t')
+        columns = None
+        for i, row in enumerate(reader):
+            if i == 0:
+                columns = row
+            if i < 6:
+                continue
+            yield {'name': row[0], 'value': float(row[-2]), 'patient': patient,
+                   'metadata': {columns[1]: row[1],
+                                columns[-1]: row[-1],
+                                }
+                   }
+
+    def request_file_info(self, data_type: str) -> pd.DataFrame:
+        df = super(miRNADatabaseInserter, self).request_file_info(data_type=data_type)
+        df = df[
+            df['cases.0.project.project_id'].str.startswith('TCGA')]
+        df = df[
+            df['file_name'].str.endswith('mirbase21.mirnas.quantification.txt')]
+        df = df[
+            df['cases.0.samples.0.sample_type'] == 'Primary Tumor']
+
+        # When there is more than one file for a single patient just keep the first
+        # (this is assuming they are just replicates and all similar)
+        df = df[~df.duplicated(
+            subset=['cases.0.submitter_id'], keep='first')]
+
+        return df
+
+
+class DNAMethylationDatabaseInserter(AbstractDatabaseInserter):
+    quantized_encoding = UINT16_ENCODING
+
+    def __init__(self, *args, **kwargs):
+        self._genes = set(pd.read_csv(Path(__file__).parent.joinpath('../DNAm_genes.csv'))['gene'].tolist())
+        super().__init__(*args, **kwargs)
+        
+        
+    def parse_patient_data(self, patient: str, f: TextIO) -> Iterator[dict]:
+        reader = csv.reader(f, delimiter='\t')
+
+        def convert_to_float(num: str):
+            try:
+                return float(num)
+            except ValueError:
+                if num == 'NA':
+                    return None
+                else:
+                    raise ValueError
+
+        for i, row in enumerate(reader):
+            if i < 6 or row[0] not in self._genes:
+                continue
+            value = convert_to_float(row[1])
+            yield {'name': row[0], 'value': quantize(value) if self.encoding else value, 'patient': patient}
+
+    def request_file_info(self, data_type: str) -> pd.DataFrame:
+        df = super().request_file_info(data_type=data_type)
+        df = df[
+            df['cases.0.project.project_id'].str.startswith('TCGA')]
+        df = df[
+            df['file_name'].str.endswith('methylation_array.sesame.level3betas.txt')]
+        df = df[
+            df['cases.0.samples.0.sample_type'] == 'Primary Tumor']
+
+        # When there is more than one file for a single patient just keep the first
+        # (this is assuming they are just replicates and all similar)
+        df = df[~df.duplicated(
+            subset=['cases.0.submitter_id'], keep='first')]
+
+        return df
+
+
+subjects = dict(mRNA='RNA-Seq',
+                DNAm='Methylation Array',
+                miRNA='miRNA-Seq')
+inserters = dict(mRNA=mRNADatabaseInserter,
+                 miRNA=miRNADatabaseInserter,
+                 DNAm=DNAMethylationDatabaseInserter
+                 )
@@ -1,4 +1,11 @@
+import hashlib
+import inspect
+import json
 import os
+import pickle
+from collections import OrderedDict, namedtuple
+from io import BytesIO, StringIO
+from typing import *
 
 import pandas as pd
 from sklearn.model_selection import train_test_split
@@ -8,31 +15,280 @@ from lifelines import KaplanMeierFitter
 import streamlit as st
 from pathlib import Path
 import plotly.express as px
+import typer
+from loguru import logger
+
+LABEL_COLS = ['submitter_id', 'days_to_last_follow_up', 'vital_status', 'days_to_death']
+KEEP_COLS = ['ajcc_pathologic_stage', 'age_at_diagnosis', 'prior_treatment', 'prior_malignancy',
+             'synchronous_malignancy', 'gender', 'race', 'ethnicity', 'disease',
+             'treatments_pharmaceutical_treatment_or_therapy',
+             'treatments_radiation_treatment_or_therapy']
+NA_VALUES = ['not reported', 'Not Reported']
+DEFAULT_CLINICAL_PATH = Path(__file__).parent.joinpath('../clinical.tsv')
+CACHE_DIR_ENV = 'TCGA_CLINICAL_CACHE_DIR'
+# Part of every stage key. Stage keys already cover the source of the stage functions, bump this when a change outside
+# of them (e.g. in a helper or a library upgrade) alters stage outputs, so persisted results are not reused
+STAGE_CACHE_VERSION = 1
+
+StageResult = namedtuple('StageResult', ['clinical', 'report'])
+
+
+class StageCache:
+    """
+    Content addressed store for stage outputs. Results are kept in a bounded in-memory LRU and, if ``cache_dir`` is
+    given, pickled to disk so they survive server restarts and are shared with headless runs.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = 32):
+        self._memory: 'OrderedDict[str, StageResult]' = OrderedDict()
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(stage: str, upstream_key: str, params: dict, code: str = '') -> str:
+        payload = json.dumps({'stage': stage, 'upstream': upstream_key, 'params': params, 'code': code,
+                              'version': STAGE_CACHE_VERSION}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def code_fingerprint(func: Callable) -> str:
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = f'{func.__module__}.{func.__qualname__}'
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get_or_compute(self, key: str, compute: Callable[[], StageResult]) -> StageResult:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = self.cache_dir.joinpath(f'{key}.pkl') if self.cache_dir else None
+        if path is not None and path.is_file():
+            with path.open('rb') as f:
+                value = pickle.load(f)
+        else:
+            value = compute()
+            if path is not None:
+                tmp_path = path.with_suffix('.tmp')
+                with tmp_path.open('wb') as f:
+                    pickle.dump(value, f)
+                tmp_path.replace(path)
+
+        self._memory[key] = value
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        return value
+
+
+def _missing_report(clinical: pd.DataFrame, columns: Iterable[str]) -> Dict[str, int]:
+    return {col: int(clinical[col].isnull().sum()) for col in columns}
+
+
+def load_clinical(source: bytes) -> StageResult:
+    clinical = pd.read_csv(BytesIO(source), sep='\t', na_values=NA_VALUES, low_memory=False)
+    return StageResult(clinical, {})
+
+
+def explore_data(clinical: pd.DataFrame) -> StageResult:
+    n = clinical.shape[0]
+    missing = {}
+
+    for col in clinical.columns:
+        if col == 'submitter_id':
+            continue
+
+        n_levels = len(clinical[col].value_counts())
+
+        if n_levels == n:
+            clinical = clinical.drop(columns=[col])
+        else:
+            n_missing = int(clinical[col].isnull().sum())
+            if n_missing > 0:
+                if n_missing == n:
+                    clinical = clinical.drop(columns=[col])
+                else:
+                    missing[col] = n_missing
+
+    return StageResult(clinical, dict(n=n, missing=missing))
+
+
+def select_variables(clinical: pd.DataFrame, label_cols: List[str], keep_cols: List[str]) -> StageResult:
+    available_columns = list(clinical.columns)
+    columns_to_drop = [col for col in clinical.columns if col not in label_cols + keep_cols]
+    clinical = clinical.drop(columns=columns_to_drop)
+
+    n = clinical.shape[0]
+    missing = {}
+    for v in clinical.columns:
+        n_missing = int(clinical[v].isnull().sum())
+        if n_missing > 0:
+            if n_missing == n:
+                clinical = clinical.drop(columns=[v])
+            else:
+                missing[v] = n_missing
+
+    selected = clinical.copy()
+    value_counts = {col: selected[col].value_counts() for col in
+                    ['gender', 'race', 'ethnicity', 'prior_malignancy', 'vital_status', 'ajcc_pathologic_stage']}
+    figures = [
+        px.histogram(y=selected['days_to_death'], title='Days to Death'),
+        px.box(selected, x='days_to_death', title='Days to Death'),
+        px.histogram(selected, x='days_to_last_follow_up', title='Days to Last Follow Up'),
+        px.box(selected, x='days_to_last_follow_up', title='Days to Last Follow Up'),
+        px.histogram(x=selected['age_at_diagnosis'].apply(lambda x: x / 365), title='Age at Diagnosis'),
+        px.box(x=selected['age_at_diagnosis'].apply(lambda x: x / 365), title='Age at Diagnosis'),
+    ]
+    info = StringIO()
+    selected.info(buf=info)
+
+    clinical = clinical.rename(columns={'disease': 'project_id'})
+    clinical = clinical.set_index('submitter_id')
+
+    return StageResult(clinical, dict(n=n, missing=missing, available_columns=available_columns, selected=selected,
+                                      value_counts=value_counts, figures=figures, describe=selected.describe(),
+                                      info=info.getvalue()))
+
+
+def cleanup_inconsistencies(clinical: pd.DataFrame) -> StageResult:
+    clinical = clinical.copy()
+    report = dict()
+
+    race_subset = clinical['race'].isnull()
+    ethnicity_subset = ~clinical['ethnicity'].isnull()
+    subset = race_subset & ethnicity_subset
+    clinical.loc[subset, 'race'] = clinical.loc[subset, 'ethnicity']
+
+    race_subset = (clinical['race'] == 'white')
+    ethnicity_subset = (~clinical['ethnicity'].isnull() &
+                        (clinical['ethnicity'] == 'hispanic or latino'))
+    subset = race_subset & ethnicity_subset
+    clinical.loc[subset, 'race'] = clinical.loc[subset, 'ethnicity']
+
+    report['white_shape'] = clinical.loc[clinical['race'] == 'white', ].shape
+
+    clinical = clinical.drop('ethnicity', axis=1)
+
+    skip = ['project_id', 'gender', 'race', 'ethnicity', 'prior_malignancy',
+            'age_at_diagnosis', 'days_to_death', 'days_to_last_follow_up']
+    report['n'] = clinical.shape[0]
+    report['missing'] = _missing_report(clinical, [v for v in clinical.columns if v not in skip])
+
+    # Drop patients missing "vital_status" information
+    subset = ~clinical.vital_status.isna()
+    clinical = clinical.loc[subset]
+
+    missing_duration_data = clinical[
+        clinical['days_to_death'].isna() &
+        clinical['days_to_last_follow_up'].isna()]
+    report['missing_duration_data'] = missing_duration_data
+
+    # Remove missing data
+    subset = ~(clinical['days_to_death'].isna() &
+               clinical['days_to_last_follow_up'].isna())
+    clinical = clinical.loc[subset]
+    report['shape_after_duration'] = clinical.shape
+
+    report['alive_missing_follow_up'] = clinical[(clinical.vital_status == 'Alive') &
+                                                 clinical.days_to_last_follow_up.isna()].shape[0]
+    report['dead_missing_death'] = clinical[(clinical.vital_status == 'Dead') &
+                                            clinical.days_to_death.isna()].shape[0]
+
+    # Remove missing data
+    subset = ~((clinical.vital_status == 'Dead') &
+               clinical.days_to_death.isna())
+    clinical = clinical.loc[subset].copy()
+
+    report['alive_missing_death'] = all(clinical[clinical.vital_status == 'Alive'].days_to_death.isna())
+
+    # Insert "NaN" in "days_to_last_follow_up" when "vital_status" is "Dead"
+    subset = clinical.vital_status == 'Dead'
+    clinical.loc[subset, 'days_to_last_follow_up'] = None
+
+    report['dead_missing_follow_up'] = all(clinical[clinical.vital_status == 'Dead'].days_to_last_follow_up.isna())
+
+    report['negative_durations'] = clinical[clinical.days_to_last_follow_up < 0]
+    # Remove data
+    subset = ~((clinical.days_to_last_follow_up < 0) &
+               (clinical.vital_status == 'Alive'))
+    clinical = clinical.loc[subset]
+    report['final_shape'] = clinical.shape
+
+    return StageResult(clinical, report)
+
+
+class ClinicalPipeline:
+    """
+    Runs the clinical parsing stages in order. Every stage is keyed by the hash of the source file contents, the
+    keys of the stages before it, its own parameters and the source code of the stage function, so only stages whose
+    inputs or code changed are recomputed.
+    """
+
+    def __init__(self, cache: StageCache, label_cols: List[str] = None, keep_cols: List[str] = None):
+        self.cache = cache
+        self.label_cols = label_cols or LABEL_COLS
+        self.keep_cols = keep_cols or KEEP_COLS
+
+    def stages(self) -> List[Tuple[str, Callable[..., StageResult], dict]]:
+        return [
+            ('load', load_clinical, {}),
+            ('explore', explore_data, {}),
+            ('select', select_variables, dict(label_cols=self.label_cols, keep_cols=self.keep_cols)),
+            ('cleanup', cleanup_inconsistencies, {}),
+        ]
+
+    def run(self, source: bytes) -> Dict[str, StageResult]:
+        key = hashlib.sha256(source).hexdigest()
+        upstream = source
+        results = OrderedDict()
+
+        for name, func, params in self.stages():
+            key = self.cache.make_key(name, key, params, code=self.cache.code_fingerprint(func))
+            result = self.cache.get_or_compute(key, lambda: func(upstream, **params))
+            results[name] = result
+            upstream = result.clinical
+
+        return results
+
+
+@st.experimental_singleton
+def get_stage_cache(cache_dir: Optional[str] = None) -> StageCache:
+    return StageCache(cache_dir=cache_dir)
 
 
 class Parser:
-    def __init__(self):
-        self.clinical: pd.DataFrame = self.get_clincal_data_file()
-        self.clinical_file_info()
+    def __init__(self, pipeline: ClinicalPipeline):
+        self.results = pipeline.run(self.get_clincal_data_file())
+        self.clinical: pd.DataFrame = self.results['cleanup'].clinical
+        self.clinical_file_info(self.results['load'].clinical)
         self.explore_data()
         self.select_variables()
         self.cleanup_inconsistencies()
 
-    
-    def get_clincal_data_file(self):
-        file = st.file_uploader(label='Uploaded Clinical Data TSV File', accept_multiple_files=False) or Path(__file__).parent.joinpath('../clinical.tsv')
-        if file is None:
+    def get_clincal_data_file(self) -> bytes:
+        file = st.file_uploader(label='Uploaded Clinical Data TSV File', accept_multiple_files=False)
+        if file is not None:
+            return file.getvalue()
+        if not DEFAULT_CLINICAL_PATH.is_file():
             st.info('Please upload TSV file to parse')
             st.stop()
-            
-        clinical = pd.read_csv('clinical.tsv', sep='\t', na_values=['not reported', 'Not Reported'], low_memory=False)
-        return clinical
-    
-    def clinical_file_info(self):
-        st.write(f'Clinical File Shape: {self.clinical.shape}')
-        st.write(self.clinical.head())
-        
+
+        return DEFAULT_CLINICAL_PATH.read_bytes()
+
+    @staticmethod
+    def clinical_file_info(clinical: pd.DataFrame):
+        st.write(f'Clinical File Shape: {clinical.shape}')
+        st.write(clinical.head())
+
+    @staticmethod
+    def write_missing(missing: Dict[str, int], n: int):
+        for col, n_missing in missing.items():
+            st.write(f'{col}: {n_missing} ({round(n_missing / n * 100, 2)}%)')
+
     def explore_data(self):
+        clinical, report = self.results['explore']
         with st.expander(label='Data Exploration'):
 
             st.markdown('''
@@ -43,194 +299,98 @@ class Parser:
             * with as many levels as there are patients
             ''')
             st.write('~~ MISSING DATA ~~')
-            
-
-            n = self.clinical.shape[0]
-
-            for col in self.clinical.columns:
-                if col == 'submitter_id':
-                    continue
+            self.write_missing(report['missing'], report['n'])
+            self.clinical_file_info(clinical)
 
-                n_levels = len(self.clinical[col].value_counts())
-                
-                if n_levels == n:
-                    self.clinical = self.clinical.drop(columns=[col])
-                else:
-                    n_missing = sum(self.clinical[col].isnull())
-                    if n_missing > 0:
-                        if n_missing == n:
-                            self.clinical = self.clinical.drop(columns=[col])
-                        else:
-                            st.write(f'{col}: {n_missing} ({round(n_missing / n * 100, 2)}%)')
-                    
-            self.clinical_file_info()
-            
     def select_variables(self):
+        _, report = self.results['select']
         with st.expander('Variable Selection'):
             st.markdown('''
             # Select variables
 
             Select a few variables to keep and drop the remaining ones.
             ''')
-            st.write(self.clinical.columns)
-            label_cols = ['submitter_id', 'days_to_last_follow_up', 'vital_status', 'days_to_death']
-            keep_cols = ['ajcc_pathologic_stage', 'age_at_diagnosis', 'prior_treatment', 'prior_malignancy',
-                        'synchronous_malignancy', 'gender', 'race', 'ethnicity', 'disease',
-                        'treatments_pharmaceutical_treatment_or_therapy',
-                        'treatments_radiation_treatment_or_therapy']
-
-            columns_to_drop = [col for col in self.clinical.columns if col not in label_cols + keep_cols]
-            self.clinical = self.clinical.drop(columns=columns_to_drop)
+            st.write(report['available_columns'])
             st.write('~~ MISSING DATA ~~')
+            self.write_missing(report['missing'], report['n'])
 
-            n = self.clinical.shape[0]
-
-            for v in self.clinical.columns:
-                n_missing = sum(self.clinical[v].isnull())
-                if n_missing > 0:
-                    if n_missing == n:
-                        self.clinical = self.clinical.drop(columns=[v])
-                    else:
-                        st.write(f'{v}: {n_missing} ({round(n_missing / n * 100, 2)}%)')
-                        
-            self.clinical_file_info()
+            self.clinical_file_info(report['selected'])
             st.markdown('''Selected clinical columns''')
-            st.write(self.clinical.columns)
-            
-            st.write(self.clinical['gender'].value_counts())
-            st.write(self.clinical['race'].value_counts())
-            st.write(self.clinical['ethnicity'].value_counts())
-            st.write(self.clinical['prior_malignancy'].value_counts())
-            st.write(self.clinical['vital_status'].value_counts())
-            st.write(self.clinical['ajcc_pathologic_stage'].value_counts())
-
-            
-            st.plotly_chart(px.histogram(y=self.clinical['days_to_death'], title='Days to Death'))
-            st.plotly_chart(px.box(self.clinical, x='days_to_death', title='Days to Death'))
-            
-            
-            st.plotly_chart(px.histogram(self.clinical, x='days_to_last_follow_up', title='Days to Last Follow Up'))
-            st.plotly_chart(px.box(self.clinical, x='days_to_last_follow_up', title='Days to Last Follow Up'))
-            
-            st.plotly_chart(px.histogram(x=self.clinical['age_at_diagnosis'].apply(lambda x: x/365), title='Age at Diagnosis'))
-            st.plotly_chart(px.box(x=self.clinical['age_at_diagnosis'].apply(lambda x: x/365), title='Age at Diagnosis'))
-            
-            st.write(self.clinical.describe())
-            st.write(self.clinical.info())
-            self.clinical = self.clinical.rename(columns={'disease': 'project_id'})
-            self.clinical = self.clinical.set_index('submitter_id')
-            
+            st.write(report['selected'].columns)
+
+            for value_counts in report['value_counts'].values():
+                st.write(value_counts)
+
+            for fig in report['figures']:
+                st.plotly_chart(fig)
+
+            st.write(report['describe'])
+            st.text(report['info'])
+
     def cleanup_inconsistencies(self):
+        _, report = self.results['cleanup']
         with st.expander('Clean Up Inconsistencies'):
             st.markdown('''
                         # Consolidate `race` and `ethnicity`
-                        ''')    
+                        ''')
             st.write('Whenever race value is "white" or missing replace it by ethnicity value (if present). Then drop ethnicity column.')
-        
-            race_subset = self.clinical['race'].isnull()
-            ethnicity_subset = ~self.clinical['ethnicity'].isnull()
-            subset = race_subset & ethnicity_subset
-            self.clinical.loc[subset, 'race'] = self.clinical.loc[subset, 'ethnicity']
-            
-            race_subset = (self.clinical['race'] == 'white')
-            ethnicity_subset = (~self.clinical['ethnicity'].isnull() &
-                                (self.clinical['ethnicity'] == 'hispanic or latino'))
-            subset = race_subset & ethnicity_subset
-            self.clinical.loc[subset, 'race'] = self.clinical.loc[subset, 'ethnicity']
-            
-            st.write(self.clinical.loc[self.clinical['race'] == 'white', ].shape)
-            
-            self.clinical = self.clinical.drop('ethnicity', axis=1)
-            
-            
+            st.write(report['white_shape'])
+
             st.markdown('''
                         # Missing label data
                         ''')
             st.write('The data show some inconsistencies, such as patients missing `vital_status` information, showing negative `days_to_last_follow_up` values, or missing days_to_death values')
-            
+
             st.write('`## Vital Status`')
             st.write('~~ MISSING DATA ~~')
-            
-            skip = ['project_id', 'gender', 'race', 'ethnicity', 'prior_malignancy',
-                    'age_at_diagnosis', 'days_to_death', 'days_to_last_follow_up']
-
-            n = self.clinical.shape[0]
-
-            for v in self.clinical.columns:
-                if v not in skip:
-                    n_missing = sum(self.clinical[v].isnull())
-                    st.write(f'{v}: {n_missing} ({round(n_missing / n * 100, 2)}%)')
-            
-            # Drop patients missing "vital_status" information        
-            subset = ~self.clinical.vital_status.isna()
-            self.clinical = self.clinical.loc[subset] 
-            
-            
+            self.write_missing(report['missing'], report['n'])
+
             st.write('`## Both duration values')
             st.write('Patients missing both time to death and time to last follow up variables cannot be included in a survival study.')
-            
-            missing_duration_data = self.clinical[
-            self.clinical['days_to_death'].isna() &
-            self.clinical['days_to_last_follow_up'].isna()]
-
-            st.write('patients missing both duration columns:', missing_duration_data.shape[0])
-            
-            st.write(missing_duration_data.head())
-
-            
-            # Remove missing data
-            subset = ~(self.clinical['days_to_death'].isna() &
-                    self.clinical['days_to_last_follow_up'].isna())
-            self.clinical = self.clinical.loc[subset]
-            
-            st.write(self.clinical.shape)
-            
+            st.write('patients missing both duration columns:', report['missing_duration_data'].shape[0])
+            st.write(report['missing_duration_data'].head())
+            st.write(report['shape_after_duration'])
+
             st.write('## Required Duration Value')
             st.write('Patients alive at the end of the study require time to last follow up information. Dead patients require time to death information.')
-            
-            
-            val = self.clinical[(self.clinical.vital_status == 'Alive') &
-                    self.clinical.days_to_last_follow_up.isna()].shape[0]
-            st.write(f'patients `missing days_to_last_follow_up` when `vital_status` is `Alive`: `{val}`')
-            
-            val = self.clinical[(self.clinical.vital_status == 'Dead') &
-               self.clinical.days_to_death.isna()].shape[0]
-            st.write(f'patients missing `days_to_death` when `vital_status` is `Dead`: `{val}`')
-            
-            # Remove missing data
-            subset = ~((self.clinical.vital_status == 'Dead') &
-                    self.clinical.days_to_death.isna())
-            self.clinical = self.clinical.loc[subset]
-            
+            st.write(f'patients `missing days_to_last_follow_up` when `vital_status` is `Alive`: `{report["alive_missing_follow_up"]}`')
+            st.write(f'patients missing `days_to_death` when `vital_status` is `Dead`: `{report["dead_missing_death"]}`')
+
             st.markdown('''## Not missing `days_to_last_follow_up` when `vital_status` is `Dead`''')
-            val = all(self.clinical[self.clinical.vital_status == 'Alive'].days_to_death.isna())
-            st.write(f'Days to death" variable missing for all patients still alive? `{val}`')
-            
-            val = all(self.clinical[self.clinical.vital_status == 'Dead'].days_to_last_follow_up.isna())
-            
-            
-            # Insert "NaN" in "days_to_last_follow_up" when "vital_status" is "Dead" 
-            subset = self.clinical.vital_status == 'Dead'
-            self.clinical.loc[subset, 'days_to_last_follow_up'] = None
-            
-            val = all(self.clinical[self.clinical.vital_status == 'Dead'].days_to_last_follow_up.isna())
-            st.write(f'`Days to last follow up` variable missing for all dead patients? `{val}`')
-                        
-                        
+            st.write(f'Days to death" variable missing for all patients still alive? `{report["alive_missing_death"]}`')
+            st.write(f'`Days to last follow up` variable missing for all dead patients? `{report["dead_missing_follow_up"]}`')
+
             st.markdown('''## Negative durations''')
-            st.write(self.clinical[self.clinical.days_to_last_follow_up < 0])
-            # Remove data
-            subset = ~((self.clinical.days_to_last_follow_up < 0) &
-                    (self.clinical.vital_status == 'Alive'))
-            self.clinical = self.clinical.loc[subset]
-            st.write(self.clinical.shape)
+            st.write(report['negative_durations'])
+            st.write(report['final_shape'])
+
+
+app = typer.Typer()
+
+
+@app.command()
+def run(clinical_path: str = typer.Option(str(DEFAULT_CLINICAL_PATH), help='Path to the clinical data TSV file'),
+        output_path: str = typer.Option(..., help='Path to write the cleaned clinical table to'),
+        cache_dir: str = typer.Option(None, help='Optional directory used to persist stage outputs between runs')):
+    """
+    Runs the clinical parsing pipeline without the Streamlit UI.
+    """
+    results = ClinicalPipeline(StageCache(cache_dir=cache_dir)).run(Path(clinical_path).read_bytes())
+    for name, (clinical, report) in results.items():
+        logger.info(f'{name}: {clinical.shape}')
+        if report.get('missing'):
+            logger.debug(f'{name} missing values: {report["missing"]}')
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    results['cleanup'].clinical.to_csv(output_path, sep='\t')
 
-            
 
+if st._is_running_with_streamlit:
+    Parser(ClinicalPipeline(get_stage_cache(os.environ.get(CACHE_DIR_ENV))))
+elif __name__ == '__main__':
+    app()
 
-Parser()
 
-        
 # clinical.columns
 # label_cols = ['submitter_id', 'days_to_last_follow_up', 'vital_status', 'days_to_death']
 
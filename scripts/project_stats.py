@@ -0,0 +1,84 @@
+from typing import *
+
+import pandas as pd
+
+from scripts.quantization import get_collection_encoding
+
+POOLED = 'pooled'
+
+
+def pipeline_for_moments_by_project(match: dict = None) -> List[dict]:
+    """
+    Count, sum and sum of squares of ``value`` for every ``(name, project)`` pair. These are enough to derive both the
+    per-project and the pooled mean and variance, so a single scan of the collection serves both.
+    """
+    pipeline = [{'$match': match}] if match else []
+    return pipeline + [
+        {
+            '$group': {
+                '_id': {'name': '$name', 'project': '$project'},
+                'count': {'$sum': {'$cond': [{'$isNumber': '$value'}, 1, 0]}},
+                'sum': {'$sum': '$value'},
+                'ssum': {'$sum': {'$multiply': ['$value', '$value']}}
+            }
+        }, {
+            '$project': {
+                '_id': 0,
+                'name': '$_id.name',
+                'project': '$_id.project',
+                'count': 1,
+                'sum': 1,
+                'ssum': 1
+            }
+        }
+    ]
+
+
+def project_collection_names(db, col_name: str) -> List[str]:
+    """
+    The collections holding ``col_name``: the collection itself and, with the per-project layout, every
+    ``<col_name>.<project>`` collection. ``DataFetcher``, ``MultiOmicsFetcher`` and ``generate-variance-table`` read
+    all of them, so both layouts are queried the same way.
+    """
+    names = db.list_collection_names()
+    return [name for name in names if name == col_name or name.startswith(f'{col_name}.')]
+
+
+def get_moments_by_project(db, col_name: str, projects: List[str] = None) -> pd.DataFrame:
+    match = {'project': {'$in': projects}} if projects else None
+    moments = []
+    for name in project_collection_names(db, col_name):
+        project = name[len(col_name) + 1:] if name != col_name else None
+        if projects and project is not None and project not in projects:
+            continue
+        df = pd.DataFrame(db[name].aggregate(pipeline_for_moments_by_project(match=match)),
+                          columns=['name', 'project', 'count', 'sum', 'ssum'])
+        if project is not None:
+            df['project'] = project
+        encoding = get_collection_encoding(db, name)
+        if encoding:
+            df['sum'] = df['sum'] / encoding['scale']
+            df['ssum'] = df['ssum'] / encoding['scale'] ** 2
+        moments.append(df)
+    return pd.concat(moments, ignore_index=True) if moments else \
+        pd.DataFrame(columns=['name', 'project', 'count', 'sum', 'ssum'])
+
+
+def summarize_moments(moments: pd.DataFrame, ddof: int = 1) -> pd.DataFrame:
+    """
+    Turns per-project moments into mean and variance for every project, plus a ``POOLED`` row per name computed from
+    the summed moments of all projects. ``ddof=1`` gives the sample variance (as ``pandas.Series.var``), ``ddof=0`` the
+    population variance (as ``$stdDevPop``); the variance is NaN where ``count <= ddof``.
+    """
+    moments = moments.groupby(['name', 'project'], as_index=False, dropna=False)[['count', 'sum', 'ssum']].sum()
+    pooled = moments.groupby('name', as_index=False)[['count', 'sum', 'ssum']].sum()
+    pooled['project'] = POOLED
+    df = pd.concat([moments, pooled], ignore_index=True)
+    df['mean'] = df['sum'] / df['count']
+    dof = (df['count'] - ddof).where(df['count'] > ddof)
+    df['var'] = ((df['ssum'] - df['count'] * df['mean'] ** 2) / dof).clip(lower=0)
+    return df[['name', 'project', 'count', 'mean', 'var']]
+
+
+def get_variance_by_project(db, col_name: str, projects: List[str] = None, ddof: int = 1) -> pd.DataFrame:
+    return summarize_moments(get_moments_by_project(db, col_name, projects=projects), ddof=ddof)
@@ -0,0 +1,73 @@
+from typing import *
+
+import numpy as np
+
+ENCODINGS_COLLECTION = '_encodings'
+
+# Beta values in [0, 1] are stored as round(beta * UINT16_SCALE), as uint16 in local matrices and as int32 in MongoDB,
+# which has no 16 bit integer type. The largest code, UINT16_NA, is reserved for missing values in local matrices; in
+# MongoDB missing values stay null, which is smaller than any number and is ignored by the aggregation operators. The
+# round trip error is at most 0.5 / UINT16_SCALE (~7.63e-6) plus half a float32 ulp below 1 (2 ** -25, ~2.98e-8) from
+# decoding to float32, far below the precision of the array platforms the values come from.
+UINT16_SCALE = 65534
+UINT16_NA = 65535
+UINT16_ENCODING = dict(type='uint16', scale=UINT16_SCALE, na=UINT16_NA)
+MAX_QUANTIZATION_ERROR = 0.5 / UINT16_SCALE + 2 ** -25
+
+
+def quantize(value: Optional[float]) -> Optional[int]:
+    if value is None or np.isnan(value):
+        return None
+    if not 0. <= value <= 1.:
+        raise ValueError(f'Only values in [0, 1] can be quantized, got {value}')
+    return int(round(value * UINT16_SCALE))
+
+
+def quantize_array(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[~np.isnan(values)]
+    if finite.size and (finite.min() < 0. or finite.max() > 1.):
+        raise ValueError('Only values in [0, 1] can be quantized')
+    present = ~np.isnan(values)
+    codes = np.full(values.shape, UINT16_NA, dtype=np.uint16)
+    codes[present] = np.rint(values[present] * UINT16_SCALE)
+    return codes
+
+
+def dequantize(values: Union[np.ndarray, Sequence], encoding: dict = None) -> np.ndarray:
+    """
+    Decodes quantized codes, either read back from MongoDB (missing values as None) or from a local matrix (missing
+    values as the NA code), into ``float32`` with NaN for missing values.
+    """
+    encoding = encoding or UINT16_ENCODING
+    codes = np.asarray(values, dtype=np.float64)
+    decoded = (codes / encoding['scale']).astype(np.float32)
+    decoded[codes == encoding['na']] = np.nan
+    return decoded
+
+
+def get_collection_encoding(db, col_name: str) -> Optional[dict]:
+    record = db[ENCODINGS_COLLECTION].find_one({'_id': col_name}, projection={'_id': 0})
+    return record or None
+
+
+def set_collection_encoding(db, col_name: str, encoding: Optional[dict]):
+    if encoding is None:
+        db[ENCODINGS_COLLECTION].delete_one({'_id': col_name})
+    else:
+        db[ENCODINGS_COLLECTION].replace_one({'_id': col_name}, encoding, upsert=True)
+
+
+def save_quantized_matrix(path: str, values: np.ndarray, **arrays):
+    """
+    Saves a matrix of values in [0, 1] as ``uint16`` codes. Additional arrays, e.g. row and column labels, are saved
+    alongside as is.
+    """
+    np.savez_compressed(path, values=quantize_array(values), scale=UINT16_SCALE, na=UINT16_NA, **arrays)
+
+
+def load_quantized_matrix(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path, allow_pickle=False) as f:
+        arrays = {key: f[key] for key in f.files if key not in ('scale', 'na')}
+        arrays['values'] = dequantize(arrays['values'], dict(scale=int(f['scale']), na=int(f['na'])))
+    return arrays
@@ -0,0 +1,138 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import *
+
+import numpy as np
+from loguru import logger
+from pymongo import MongoClient
+
+from scripts.project_stats import project_collection_names
+from scripts.quantization import dequantize, get_collection_encoding
+
+AlignedBatch = namedtuple('AlignedBatch', ['patients', 'features', 'values', 'mask'])
+
+
+class MultiOmicsFetcher:
+    """
+    Fetches values for a list of patients across several omics collections at once. Each modality is read with a
+    single ``$in`` query on ``(patient, name)`` and all modalities are queried concurrently. The results are aligned
+    to the requested patient order:
+
+    * ``values[modality]`` is a ``float32`` array of shape ``(n_patients, n_features)``, NaN where a value is missing
+    * ``mask`` is a boolean array of shape ``(n_patients, n_modalities)``, True where the patient has any data in
+      that modality
+
+    Names are not unique in every modality, e.g. mRNA ``_PAR_Y`` genes share the name of their X copy and are all zero
+    in STAR counts. Where several values share a ``(patient, name)`` the largest one is kept, so the result does not
+    depend on the order MongoDB returns documents in.
+    """
+
+    def __init__(self, mongodb_connection_string: str, db_name: str, collections: Dict[str, str] = None,
+                 max_workers: int = None):
+        self._client = MongoClient(mongodb_connection_string)
+        self._db = self._client[db_name]
+        self.collections = collections or dict(mRNA='mRNA', miRNA='miRNA', DNAm='DNAm')
+        self.max_workers = max_workers or len(self.collections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._client.close()
+
+    @lru_cache
+    def get_encoding(self, collection_name: str) -> Optional[dict]:
+        return get_collection_encoding(self._db, collection_name)
+
+    @lru_cache
+    def get_collection_names(self, modality: str) -> Tuple[str, ...]:
+        return tuple(project_collection_names(self._db, self.collections[modality]))
+
+    @lru_cache
+    def get_all_names(self, modality: str) -> Tuple[str, ...]:
+        return tuple(sorted(set().union(*[self._db[name].distinct('name')
+                                          for name in self.get_collection_names(modality)])))
+
+    def fetch_modality(self, modality: str, patients: List[str], features: Sequence[str],
+                       patient_index: Dict[str, int], all_features: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param all_features: If True, ``features`` holds every name in the collection and the query is not filtered by
+            name, which would otherwise send (and walk the index for) every distinct name
+        """
+        feature_index = {name: j for j, name in enumerate(features)}
+        values = np.full((len(patients), len(features)), np.nan, dtype=np.float32)
+        filled = np.zeros((len(patients), len(features)), dtype=bool)
+        present = np.zeros(len(patients), dtype=bool)
+
+        query = {'patient': {'$in': patients}}
+        if not all_features:
+            query['name'] = {'$in': list(features)}
+        duplicates = 0
+        for collection_name in self.get_collection_names(modality):
+            # Every collection carries its own encoding, so the cells it filled are decoded before the next one is read
+            encoding = self.get_encoding(collection_name)
+            decode = np.zeros_like(filled) if encoding else None
+            cursor = self._db[collection_name].find(
+                query,
+                projection={'_id': 0, 'patient': 1, 'name': 1, 'value': 1},
+                batch_size=10000
+            )
+            for doc in cursor:
+                row = patient_index[doc['patient']]
+                present[row] = True
+                column = feature_index.get(doc['name'])
+                if column is None:
+                    continue
+                value = doc.get('value')
+                if filled[row, column]:
+                    duplicates += 1
+                    # find() returns documents in no particular order, so the kept value must not depend on it
+                    if value is None or not (np.isnan(values[row, column]) or value > values[row, column]):
+                        continue
+                filled[row, column] = True
+                if value is not None:
+                    values[row, column] = value
+                    if decode is not None:
+                        decode[row, column] = True
+            if decode is not None:
+                values[decode] = dequantize(values[decode], encoding)
+
+        if duplicates:
+            # e.g. mRNA gene names are not unique (PAR_Y genes share the name of their X copy)
+            logger.warning(f'{modality}: {duplicates} values share a (patient, name) with another value, only the '
+                           f'largest one is kept')
+
+        logger.debug(f'{modality}: {present.sum()}/{len(patients)} patients present')
+        return values, present
+
+    def fetch(self, patients: List[str], features: Dict[str, Optional[Sequence[str]]]) -> AlignedBatch:
+        """
+        :param patients: Patient identifiers, defines the row order of every returned array
+        :param features: Mapping from modality to the feature names to fetch. ``None`` fetches every name in the
+            modality's collection
+        """
+        patients = list(patients)
+        patient_index = {patient: i for i, patient in enumerate(patients)}
+        if len(patient_index) != len(patients):
+            raise ValueError('Patient list contains duplicates')
+
+        modalities = list(features.keys())
+        all_features = {modality for modality, names in features.items() if names is None}
+        features = {modality: tuple(names) if names is not None else self.get_all_names(modality)
+                    for modality, names in features.items()}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {modality: executor.submit(self.fetch_modality, modality, patients, features[modality],
+                                                 patient_index, modality in all_features)
+                       for modality in modalities}
+            results = {modality: future.result() for modality, future in futures.items()}
+
+        values = {modality: results[modality][0] for modality in modalities}
+        mask = np.stack([results[modality][1] for modality in modalities], axis=1) if modalities else \
+            np.zeros((len(patients), 0), dtype=bool)
+
+        return AlignedBatch(patients=patients, features=features, values=values, mask=mask)
@@ -0,0 +1,163 @@
+import gzip
+import io
+import queue
+import tarfile
+import threading
+from pathlib import Path
+from typing import *
+
+TARBALL_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+
+
+def is_tarball(path: Union[str, Path]) -> bool:
+    return str(path).endswith(TARBALL_SUFFIXES)
+
+
+def strip_gz(name: str) -> str:
+    return name[:-len('.gz')] if name.endswith('.gz') else name
+
+
+def open_decompressed(name: str, stream: BinaryIO) -> Tuple[str, BinaryIO]:
+    if name.endswith('.gz'):
+        return strip_gz(name), gzip.GzipFile(fileobj=stream, mode='rb')
+    return name, stream
+
+
+def iter_source_files(base_dir: str, match: Callable[[str], bool]) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Yields ``(name, stream)`` for every file under ``base_dir`` whose name (without a ``.gz`` suffix) satisfies
+    ``match``. Plain files, gzipped files and members of tarballs are all streamed in place, without extracting anything
+    to disk or reading whole files into memory. ``base_dir`` may itself be a tarball. A stream is only valid until the
+    next file is requested.
+    """
+    base_dir = Path(base_dir)
+    paths = [base_dir] if base_dir.is_file() else sorted(p for p in base_dir.rglob('*') if p.is_file())
+
+    for path in paths:
+        if is_tarball(path):
+            with tarfile.open(path, mode='r|*') as tar:
+                for member in tar:
+                    if not member.isfile() or not match(strip_gz(member.name)):
+                        continue
+                    yield open_decompressed(member.name, tar.extractfile(member))
+        else:
+            name = str(path.relative_to(base_dir))
+            if match(strip_gz(name)):
+                with path.open('rb') as f:
+                    yield open_decompressed(name, f)
+
+
+class _ReadError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _FileStart:
+    def __init__(self, name: str):
+        self.name = name
+
+
+_FILE_END = object()
+_DONE = object()
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Reads the chunks of a single file from the queue filled by ``stream_files``.
+    """
+
+    def __init__(self, chunks: queue.Queue):
+        self._chunks = chunks
+        self._chunk = memoryview(b'')
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_chunk(self):
+        item = self._chunks.get()
+        if isinstance(item, _ReadError):
+            raise item.error
+        if item is _FILE_END:
+            self._eof = True
+        else:
+            self._chunk = memoryview(item)
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk and not self._eof:
+            self._next_chunk()
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def drain(self):
+        while not self._eof:
+            self._next_chunk()
+
+
+def stream_files(files: Iterable[Tuple[str, BinaryIO]], chunk_size: int = 2 ** 20,
+                 max_chunks: int = 8) -> Iterator[Tuple[str, TextIO]]:
+    """
+    Reads and decompresses ``files`` on a background thread and yields ``(name, text stream)`` for each of them. The
+    reader hands fixed size chunks to the caller through a queue holding at most ``max_chunks`` of them, so reading
+    overlaps with parsing while memory stays bounded by ``max_chunks * chunk_size`` regardless of the file sizes. A
+    stream is only valid until the next file is requested; unread parts of it are skipped. When the caller stops
+    early, closing the generator stops the reader thread and closes ``files``.
+    """
+    if chunk_size < 1 or max_chunks < 1:
+        raise ValueError(f'chunk_size and max_chunks must be at least 1, got {chunk_size} and {max_chunks}')
+    chunks = queue.Queue(maxsize=max_chunks)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        files_iter = iter(files)
+        try:
+            for name, stream in files_iter:
+                if not put(_FileStart(name)):
+                    return
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    if not put(chunk):
+                        return
+                if not put(_FILE_END):
+                    return
+        except BaseException as e:
+            put(_ReadError(e))
+        finally:
+            put(_DONE)
+            # Closes the file or tarball the source generator is paused in
+            if hasattr(files_iter, 'close'):
+                files_iter.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _ReadError):
+                raise item.error
+            reader = _ChunkReader(chunks)
+            yield item.name, io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8', newline='')
+            reader.drain()
+    finally:
+        stop.set()
+
+
+def file_key(path: str) -> str:
+    """
+    Identifies a GDC file by its last two path components, i.e. ``<id>/<file_name>``.
+    """
+    return '/'.join(Path(path).parts[-2:])
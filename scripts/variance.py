@@ -0,0 +1,93 @@
+import csv
+import itertools
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import *
+
+from tqdm import tqdm
+
+from scripts.sources import iter_source_files, stream_files
+
+
+class AbstractVarianceComputer(ABC):
+    def __init__(self, base_dir: str, ext: str, output_path: str) -> None:
+        self.base_dir = base_dir
+        self.ext = ext
+
+        self.output_path = Path(output_path)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        self.parse_variance()
+        
+    def get_files(self, base_dir: str, ext: str) -> Iterator[Tuple[str, BinaryIO]]:
+        assert Path(base_dir).exists()
+
+        return iter_source_files(base_dir, lambda name: name.endswith(f'.{ext}'))
+
+    @staticmethod
+    def tofloat(num):
+        try:
+            return float(num)
+            
+        except ValueError:
+            return None
+    
+    @abstractmethod
+    def parse_file(self, f: TextIO) -> dict:
+        ...
+        
+    def parse_variance(self):
+        out = dict()
+        
+        for _, f in tqdm(stream_files(self.get_files(self.base_dir, self.ext))):
+            parsed = self.parse_file(f)
+            
+            for key, values in parsed.items():
+                if key not in out:
+                    out[key] = dict(sum=0., ssum=0., count=0)
+                out[key]['sum'] += values['sum']
+                out[key]['ssum'] += values['ssum']
+                out[key]['count'] += values['count']
+        with open(self.output_path, 'w') as f:
+            json.dump(out, f, indent=2)
+    
+    
+            
+        
+class mRNAVarianceComputer(AbstractVarianceComputer):
+    def parse_file(self, f: TextIO) -> dict:
+        reader = csv.reader(f, delimiter='\t')
+        data = itertools.islice(reader, 6, None)
+        out = dict()
+        for item in data:
+            if item[0] not in out.keys():
+                out[item[0]] = dict(sum=0., ssum=0., count=0)
+                
+            val = self.tofloat(item[-1])
+            if val is not None:
+                out[item[0]]['count'] += 1
+                out[item[0]]['sum'] = val
+                out[item[0]]['ssum'] = val ** 2
+            
+        return out
+    
+class DNAmVarianceComputer(AbstractVarianceComputer):
+    def parse_file(self, f: TextIO) -> dict:
+        data = csv.reader(f, delimiter='\t')
+
+        out = dict()
+        for item in data:
+            if item[0] not in out.keys():
+                out[item[0]] = dict(sum=0., ssum=0., count=0)
+                
+            val = self.tofloat(item[-1])
+            if val is not None:
+                out[item[0]]['count'] += 1
+                out[item[0]]['sum'] = val
+                out[item[0]]['ssum'] = val ** 2
+            
+        return out
+    
+variance_computers = dict(mRNA=mRNAVarianceComputer,
+                          DNAm=DNAmVarianceComputer)
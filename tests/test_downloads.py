@@ -0,0 +1,82 @@
+import os
+import sys
+import textwrap
+from pathlib import Path
+
+from scripts.downloads import DownloadSupervisor, Segment
+
+FIELDNAMES = ['id', 'filename', 'md5', 'size', 'state']
+
+# Mimics gdc-client: every file is written to "<filename>.partial" in chunks and renamed once complete
+FAKE_GDC_CLIENT = textwrap.dedent('''\
+    import csv, os, sys, time
+    manifest = sys.argv[sys.argv.index('-m') + 1]
+    directory = sys.argv[sys.argv.index('-d') + 1]
+    with open(manifest) as f:
+        rows = list(csv.DictReader(f, delimiter='\\t'))
+    for row in rows:
+        path = os.path.join(directory, row['id'], row['filename'])
+        if os.path.isfile(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = int(row['size'])
+        with open(path + '.partial', 'wb') as f:
+            for i in range(5):
+                f.write(b'x' * (size // 5 if i < 4 else size - 4 * (size // 5)))
+                f.flush()
+                time.sleep(0.04)
+        os.rename(path + '.partial', path)
+        print('downloaded', row['id'], flush=True)
+''')
+
+
+def make_files(prefix: str, n: int, size: int = 1000):
+    return [dict(id=f'{prefix}{i}', filename=f'{prefix}{i}.txt', md5='0', size=str(size), state='released')
+            for i in range(n)]
+
+
+def write_file(directory: Path, file: dict, size: int, partial: bool = False):
+    path = directory.joinpath(file['id'], file['filename'] + ('.partial' if partial else ''))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+
+
+def test_partial_files_count_as_progress_but_not_as_complete(tmp_path):
+    files = make_files('f', 3)
+    segment = Segment(tmp_path.joinpath('manifest.txt'), FIELDNAMES, files)
+    write_file(tmp_path, files[0], 1000)
+    write_file(tmp_path, files[1], 600, partial=True)
+    write_file(tmp_path, files[2], 1000, partial=True)
+
+    segment.update(str(tmp_path), elapsed=0)
+
+    assert segment.bytes_done == 2600
+    assert [f['id'] for f in segment.remaining_files(str(tmp_path))] == ['f1', 'f2']
+
+
+def test_supervisor_downloads_everything_and_splits_stragglers(tmp_path, monkeypatch):
+    bin_dir = tmp_path.joinpath('bin')
+    bin_dir.mkdir()
+    client = bin_dir.joinpath('gdc-client')
+    client.write_text(f'#!{sys.executable}\n' + FAKE_GDC_CLIENT)
+    client.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+
+    output = tmp_path.joinpath('out')
+    manifests = []
+    all_files = []
+    for name, files in [('small', make_files('s', 1)), ('large', make_files('l', 6))]:
+        all_files.extend(files)
+        segment = Segment(tmp_path.joinpath(f'{name}.txt'), FIELDNAMES, files)
+        segment.write(segment.manifest_path)
+        manifests.append(segment.manifest_path)
+
+    supervisor = DownloadSupervisor(manifests, str(output), number_of_concurrent_downloads=2, report_interval=0.05,
+                                    straggler_grace=0, min_split_eta=0)
+    supervisor.run()
+
+    for file in all_files:
+        assert output.joinpath(file['id'], file['filename']).stat().st_size == 1000
+    assert not list(output.rglob('*.partial'))
+    assert list(output.joinpath('.resplit').glob('large_r*.txt'))
+    assert len(supervisor.segments) > 2
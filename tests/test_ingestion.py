@@ -0,0 +1,149 @@
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from scripts import ingestion
+from scripts.ingestion import FILES_COLLECTION, ShardCoordinator, mRNADatabaseInserter
+from scripts.quantization import UINT16_ENCODING, set_collection_encoding
+
+FILE_NAME = 'x.rna_seq.augmented_star_gene_counts.tsv'
+COLUMNS = ['gene_id', 'gene_name', 'gene_type', 'unstranded', 'stranded_first', 'stranded_second', 'tpm_unstranded',
+           'fpkm_unstranded', 'fpkm_uq_unstranded']
+
+
+def write_counts(base_dir, file_id: str, genes: list):
+    """
+    Writes a STAR gene counts file with one row per ``(gene_id, gene_name, value)``.
+    """
+    rows = ['# gene-model: GENCODE v36', '\t'.join(COLUMNS)] + ['N_unmapped' + '\t' * 8] * 4
+    rows += ['\t'.join([gene_id, gene_name, 'protein_coding', '1', '1', '1', '1', '1', str(value)])
+             for gene_id, gene_name, value in genes]
+    path = base_dir.joinpath(file_id, FILE_NAME)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('\n'.join(rows) + '\n')
+
+
+def write_file_info(tmp_path, files: list):
+    """
+    Writes a sample sheet and a manifest for ``(file_id, patient, project, md5)`` entries.
+    """
+    with tmp_path.joinpath('annotations.tsv').open('w') as f:
+        f.write('File ID\tFile Name\tCase ID\tSample Type\tProject ID\n')
+        for file_id, patient, project, _ in files:
+            f.write(f'{file_id}\t{FILE_NAME}\t{patient}\tPrimary Tumor\t{project}\n')
+    with tmp_path.joinpath('manifest.tsv').open('w') as f:
+        f.write('id\tfilename\tmd5\tsize\tstate\n')
+        for file_id, _, _, md5 in files:
+            f.write(f'{file_id}\t{FILE_NAME}\t{md5}\t1\treleased\n')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(ingestion.pymongo, 'MongoClient', lambda *args, **kwargs: client)
+    return client
+
+
+def ingest(tmp_path, **kwargs):
+    mRNADatabaseInserter(subject='mRNA', base_dir=str(tmp_path.joinpath('data')), mongo_connection_string='',
+                         db_name='db', col_name='mRNA', annotations_path=str(tmp_path.joinpath('annotations.tsv')),
+                         manifest_path=str(tmp_path.joinpath('manifest.tsv')), batch_size=2, **kwargs)
+
+
+def documents(client) -> list:
+    return sorted((doc['patient'], doc['name'], doc['metadata']['gene_id'], doc['value'])
+                  for doc in client.db.mRNA.find())
+
+
+def test_delta_refresh_with_duplicate_names_matches_fresh_load(tmp_path, client):
+    data = tmp_path.joinpath('data')
+    write_counts(data, 'a1', [('ENSG1', 'G1', 1), ('ENSG2', 'PAR', 2), ('ENSG2_PAR_Y', 'PAR', 3)])
+    write_counts(data, 'b1', [('ENSG1', 'G1', 4)])
+    write_file_info(tmp_path, [('a1', 'A', 'TCGA-X', 'm1'), ('b1', 'B', 'TCGA-X', 'm2')])
+    ingest(tmp_path, override=True)
+
+    write_counts(data, 'a2', [('ENSG1', 'G1', 10), ('ENSG2', 'PAR', 20), ('ENSG2_PAR_Y', 'PAR', 30),
+                              ('ENSG3', 'G3', 40), ('ENSG3_PAR_Y', 'G3', 50)])
+    write_file_info(tmp_path, [('a2', 'A', 'TCGA-X', 'm3'), ('b1', 'B', 'TCGA-X', 'm2')])
+    ingest(tmp_path, override=False, delta=True)
+    refreshed = documents(client)
+
+    ingest(tmp_path, override=True)
+    assert refreshed == documents(client)
+    assert [doc for doc in refreshed if doc[0] == 'A'] == [
+        ('A', 'G1', 'ENSG1', 10.), ('A', 'G3', 'ENSG3', 40.), ('A', 'G3', 'ENSG3_PAR_Y', 50.),
+        ('A', 'PAR', 'ENSG2', 20.), ('A', 'PAR', 'ENSG2_PAR_Y', 30.)]
+
+
+def test_first_delta_on_untracked_collection_reloads_and_removes_patients(tmp_path, client):
+    data = tmp_path.joinpath('data')
+    write_counts(data, 'a1', [('ENSG1', 'G1', 1)])
+    write_counts(data, 'b1', [('ENSG1', 'G1', 2)])
+    write_file_info(tmp_path, [('a1', 'A', 'TCGA-X', 'm1'), ('b1', 'B', 'TCGA-X', 'm2')])
+    ingest(tmp_path, override=True)
+    client.db[FILES_COLLECTION].drop()
+
+    write_counts(data, 'a2', [('ENSG1', 'G1', 3)])
+    write_file_info(tmp_path, [('a2', 'A', 'TCGA-X', 'm3')])
+    ingest(tmp_path, override=False, delta=True)
+
+    assert documents(client) == [('A', 'G1', 'ENSG1', 3.)]
+    assert [(record['patient'], record['file_id']) for record in client.db[FILES_COLLECTION].find()] == [('A', 'a2')]
+
+
+def test_delta_keeps_patients_whose_new_file_is_missing(tmp_path, client):
+    data = tmp_path.joinpath('data')
+    write_counts(data, 'a1', [('ENSG1', 'G1', 1)])
+    write_file_info(tmp_path, [('a1', 'A', 'TCGA-X', 'm1')])
+    ingest(tmp_path, override=True)
+
+    write_file_info(tmp_path, [('a2', 'A', 'TCGA-X', 'm2')])
+    ingest(tmp_path, override=False, delta=True)
+    assert documents(client) == [('A', 'G1', 'ENSG1', 1.)]
+    assert [(record['patient'], record['file_id']) for record in client.db[FILES_COLLECTION].find()] == [('A', 'a1')]
+
+    write_counts(data, 'a2', [('ENSG1', 'G1', 2)])
+    ingest(tmp_path, override=False, delta=True)
+    assert documents(client) == [('A', 'G1', 'ENSG1', 2.)]
+
+
+def test_reused_run_id_is_rejected_by_every_shard(client):
+    db = client.db
+    coordinator = ShardCoordinator(db, 'mRNA', 'run', shard_index=0, shard_count=2, poll_interval=0, timeout=1)
+    coordinator.start()
+    coordinator.mark_ready()
+    ShardCoordinator(db, 'mRNA', 'run', shard_index=1, shard_count=2, poll_interval=0, timeout=1).wait_until_ready()
+
+    with pytest.raises(ValueError):
+        ShardCoordinator(db, 'mRNA', 'run', shard_index=0, shard_count=2, poll_interval=0, timeout=1).start()
+    with pytest.raises(ValueError):
+        ShardCoordinator(db, 'mRNA', 'run', shard_index=1, shard_count=2, poll_interval=0, timeout=1).wait_until_ready()
+
+
+def test_shard_rejects_settings_that_differ_from_the_coordinator(tmp_path, client):
+    write_counts(tmp_path.joinpath('data'), 'a1', [('ENSG1', 'G1', 1)])
+    write_file_info(tmp_path, [('a1', 'A', 'TCGA-X', 'm1')])
+    coordinator = ShardCoordinator(client.db, 'mRNA', 'run', shard_index=0, shard_count=2,
+                                   settings=dict(project_layout='field'))
+    coordinator.start()
+    set_collection_encoding(client.db, 'mRNA', UINT16_ENCODING)
+    coordinator.mark_ready()
+
+    with pytest.raises(ValueError, match='Settings mismatch'):
+        ingest(tmp_path, shard_index=1, shard_count=2, run_id='run', project_layout='collection', shard_timeout=1)
+    with pytest.raises(ValueError, match='encoding'):
+        ingest(tmp_path, shard_index=1, shard_count=2, run_id='run', shard_timeout=1)
+    assert not client.db.mRNA.count_documents({})
+
+
+def test_delta_only_adds_a_patient_index_if_none_leads_with_patient(tmp_path, client):
+    write_counts(tmp_path.joinpath('data'), 'a1', [('ENSG1', 'G1', 1)])
+    write_file_info(tmp_path, [('a1', 'A', 'TCGA-X', 'm1')])
+    ingest(tmp_path, override=False, delta=True, indexes=[[['patient', 1], ['name', 1]]])
+    assert [index['key'] for index in client.db.mRNA.list_indexes() if index['name'] != '_id_'] == [
+        {'patient': 1, 'name': 1}]
+
+    client.db.mRNA.drop()
+    ingest(tmp_path, override=False, delta=True, indexes=[[['name', 1]]])
+    assert [index['key'] for index in client.db.mRNA.list_indexes() if index['name'] != '_id_'] == [
+        {'name': 1}, {'patient': 1}]
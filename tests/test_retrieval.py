@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from scripts import retrieval
+from scripts.retrieval import MultiOmicsFetcher
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(retrieval, 'MongoClient', lambda *args, **kwargs: client)
+    return client
+
+
+@pytest.mark.parametrize('order', [1, -1])
+def test_duplicate_names_keep_the_largest_value_in_any_order(client, order):
+    docs = [{'patient': 'A', 'name': 'PAR', 'value': 5.}, {'patient': 'A', 'name': 'PAR', 'value': 0.},
+            {'patient': 'A', 'name': 'PAR', 'value': None}, {'patient': 'A', 'name': 'G1', 'value': 1.}]
+    client.db.mRNA.insert_many(docs[::order])
+
+    with MultiOmicsFetcher('', 'db', collections=dict(mRNA='mRNA')) as fetcher:
+        batch = fetcher.fetch(patients=['A', 'B'], features={'mRNA': ['G1', 'PAR']})
+
+    np.testing.assert_array_equal(batch.values['mRNA'], np.array([[1., 5.], [np.nan, np.nan]], dtype=np.float32))
+    np.testing.assert_array_equal(batch.mask, [[True], [False]])